@@ -1,17 +1,42 @@
 import asyncio
+import collections
+import datetime
+import io
+import re
 import sys
+import time
 import traceback
 
 import discord
 from discord.ext import commands
 
+import bancache
+import channelarchive
+import formatter
+import messagefilters
+import progress
 import utils
 
+# Discord refuses to bulk delete messages older than two weeks; leave
+# some slack for messages aging while we work.
+BULK_DELETE_MAX_AGE = datetime.timedelta(days=14) - datetime.timedelta(minutes=5)
+SINGLE_DELETE_WORKERS = 2
+# Ban lists longer than this (a few messages' worth) are sent as a
+# file instead.
+BANLIST_MAX_SIZE = 5000
+# Most messages a filtered deletion looks at before giving up.
+SCAN_BUDGET = utils.setting('DELETE_SCAN_BUDGET', 250000)
+# Bans share a rate limit, which the HTTP client waits on for us; a
+# few concurrent requests are enough to keep it busy.
+BAN_WORKERS = 4
+
+_snowflake_re = re.compile(r'\b\d{15,21}\b')
+
 
 class AdminTools(commands.Cog, name='Admin'):
     def __init__(self, bot):
         self.bot = bot
-        self.deleting = set()
+        self.bans = bancache.BanCache()
 
     @commands.command()
     @commands.has_permissions(ban_members=True)
@@ -28,35 +53,149 @@ class AdminTools(commands.Cog, name='Admin'):
 
     @commands.command()
     @commands.has_permissions(ban_members=True)
-    async def banlist(self, ctx):
-        """List the Discrd IDs of all banned users.
+    @commands.bot_has_permissions(ban_members=True)
+    async def ban_ids(self, ctx, *, ids: str = ''):
+        """Bans a list of users by their Discord IDs.
+
+        Paste the IDs, one per line, or attach a text file of them.
+        Users who are already banned are skipped.
+        """
+        text = ids
+        for attachment in ctx.message.attachments:
+            text += '\n' + (await attachment.read()).decode('utf-8', 'replace')
+        user_ids = list(collections.OrderedDict.fromkeys(
+            int(user_id) for user_id in _snowflake_re.findall(text)))
+        if not user_ids:
+            await ctx.reply("I didn't find any Discord IDs in that.")
+            return
+
+        job_id = ('ban', ctx.guild.id)
+        if job_id in self.bot.jobs:
+            await ctx.reply("Already banning a list of users, be patient.")
+            return
+        bans = await self.bans.get(ctx.guild)
+        new_ids = [user_id for user_id in user_ids if user_id not in bans]
+        if not new_ids:
+            await ctx.reply("All of those users are already banned.")
+            return
+        self.bot.jobs.start(job_id, self.run_bans(ctx, new_ids, len(user_ids) - len(new_ids)))
+
+    async def run_bans(self, ctx, user_ids, skipped):
+        notice = await ctx.send("Banning {} users...".format(len(user_ids)))
+        pending = iter(user_ids)
+        banned, failed = [], []
+        reason = 'Bulk ban by {}'.format(ctx.author)
+
+        async def ban_pending():
+            for user_id in pending:
+                try:
+                    await ctx.guild.ban(discord.Object(id=user_id), reason=reason,
+                                        delete_message_days=0)
+                except discord.HTTPException:
+                    failed.append(user_id)
+                else:
+                    banned.append(user_id)
+                reporter.update()
+
+        def summary():
+            message = "Banned {} users.".format(len(banned))
+            if skipped:
+                message += " {} were already banned.".format(skipped)
+            if failed:
+                shown = ', '.join(str(user_id) for user_id in failed[:20])
+                if len(failed) > 20:
+                    shown += ' and {} more'.format(len(failed) - 20)
+                message += " Couldn't ban {}: {}.".format(len(failed), shown)
+            return message
+
+        reporter = progress.ProgressReporter(notice, lambda: "Banning users ({}/{})...".format(
+            len(banned) + len(failed), len(user_ids)))
+        try:
+            await asyncio.gather(*[ban_pending() for _ in range(BAN_WORKERS)])
+        except asyncio.CancelledError:
+            await reporter.finish("Stopped. " + summary())
+            raise
+        await reporter.finish(summary())
+
+    @commands.group(invoke_without_command=True)
+    @commands.has_permissions(ban_members=True)
+    @commands.bot_has_permissions(ban_members=True)
+    async def banlist(self, ctx, *, search: str = ''):
+        """List the Discord IDs of banned users.
+
+        Give an ID or the start of a name to only list matching users.
+        Long lists are sent as a file.
         """
-        banned = await ctx.guild.bans()
-        msg = '\n'.join('{} - {}'.format(entry.user.id, str(entry.user))
-                        for entry in banned)
-        await ctx.reply("banned users: ```{}```".format(msg))
+        bans = await self.bans.get(ctx.guild)
+        users = bans.search(search) if search else bans.sorted()
+        if not users:
+            await ctx.reply("No banned users found.")
+            return
+
+        lines = ['{} - {}'.format(user.id, str(user)) for user in users]
+        if sum(len(line) + 1 for line in lines) > BANLIST_MAX_SIZE:
+            await self.send_banlist_file(ctx, users)
+            return
+
+        block = formatter.TextBlock(prefix='```\n', suffix='```')
+        for line in lines:
+            block.add_line(line)
+        await ctx.reply("{} banned users:".format(len(users)))
+        for page in block.render_pages(max_size=2000):
+            await ctx.send(page)
+
+    @banlist.command(name='export')
+    @commands.has_permissions(ban_members=True)
+    @commands.bot_has_permissions(ban_members=True)
+    async def banlist_export(self, ctx):
+        """Send the list of all banned users as a file.
+        """
+        bans = await self.bans.get(ctx.guild)
+        await self.send_banlist_file(ctx, bans.sorted())
+
+    async def send_banlist_file(self, ctx, users):
+        text = ''.join('{}\t{}\n'.format(user.id, str(user)) for user in users)
+        attachment = discord.File(io.BytesIO(text.encode('utf-8')), filename='banlist.txt')
+        await ctx.reply("{} banned users:".format(len(users)), file=attachment)
+
+    @commands.Cog.listener()
+    async def on_member_ban(self, guild, user):
+        self.bans.add(guild, user)
+
+    @commands.Cog.listener()
+    async def on_member_unban(self, guild, user):
+        self.bans.remove(guild, user)
+
+    @commands.Cog.listener()
+    async def on_guild_remove(self, guild):
+        self.bans.forget(guild)
 
     @commands.group(invoke_without_command=True)
     @commands.has_permissions(manage_messages=True)
     @commands.bot_has_permissions(manage_messages=True)
-    async def delete(self, ctx, *, num_messages: int = 50):
+    async def delete(self, ctx, *, filters: str = ''):
         """Delete recent messages from this channel.
 
+        Deletes the last 50 messages, or as many as you say. Add filters
+        to only delete some messages: `from:@user`, `matching:<regex>`,
+        `before:`/`after:` a date, message ID or duration ago (`2h`),
+        and `has:attachment`, `has:embed` or `has:link`.
+
         Pinned messages will be skipped. Requires the the 'Manage
         Messages' permission.
         """
-        await self.purge_channel(ctx, num_messages)
+        await self.purge_channel(ctx, filters, 50)
 
     @delete.command(name='all')
     @commands.has_permissions(manage_messages=True)
     @commands.bot_has_permissions(manage_messages=True)
-    async def delete_all(self, ctx):
+    async def delete_all(self, ctx, *, filters: str = ''):
         """Delete all messages from this channel.
 
-        Pinned messages will be skipped. Requires the the 'Manage
-        Messages' permission.
+        Takes the same filters as `delete`. Pinned messages will be
+        skipped. Requires the the 'Manage Messages' permission.
         """
-        await self.purge_channel(ctx, None)
+        await self.purge_channel(ctx, filters, None)
 
     @delete.command(name='stop')
     @commands.has_permissions(manage_messages=True)
@@ -64,50 +203,260 @@ class AdminTools(commands.Cog, name='Admin'):
     async def delete_stop(self, ctx):
         """Stop an in-progress message deletion in this channel.
         """
-        channel = ctx.message.channel
-        if channel in self.deleting:
-            self.deleting.remove(channel)
+        if self.bot.jobs.cancel(('delete', ctx.channel.id)):
             await ctx.reply("Stopped message deletion process.")
         else:
             await ctx.reply("No message deletion in progress in this channel.")
 
+    @commands.group(invoke_without_command=True)
+    @commands.has_permissions(manage_messages=True)
+    @commands.bot_has_permissions(read_message_history=True)
+    async def archive(self, ctx):
+        """Save a copy of all messages in this channel.
+
+        The copy is written to a file on the bot's server. No messages
+        can be deleted from the channel while it's being archived.
+        Requires the 'Manage Messages' permission.
+        """
+        await self.archive_channel(ctx, purge=False)
+
+    @archive.command(name='delete')
+    @commands.has_permissions(manage_messages=True)
+    @commands.bot_has_permissions(manage_messages=True, read_message_history=True)
+    async def archive_delete(self, ctx):
+        """Save a copy of all messages in this channel, then delete them.
+
+        Once the copy is saved, this works like `delete all`, and can be
+        stopped with `delete stop`. Requires the 'Manage Messages'
+        permission.
+        """
+        await self.archive_channel(ctx, purge=True)
+
     @ban_id.error
+    @ban_ids.error
+    @banlist.error
+    @banlist_export.error
     @delete.error
     @delete_all.error
     @delete_stop.error
+    @archive.error
+    @archive_delete.error
     async def missing_permissions(self, error, ctx):
         if utils.is_local_check_failure(error):
             message = ("Permissions check failed. Either you're not allowed to use that "
                        "command or the bot is missing a permission required to execute it.")
             await ctx.reply(message)
 
-    async def purge_channel(self, ctx, num_messages=None):
-        channel = ctx.channel
-        if channel.id in self.deleting:
+    async def purge_channel(self, ctx, filters, num_messages=None):
+        job_id = ('delete', ctx.channel.id)
+        if job_id in self.bot.jobs:
+            await ctx.reply("Deletion already in progress, be patient.")
+            return
+
+        try:
+            selected, rest = messagefilters.parse(ctx.guild, filters)
+        except messagefilters.FilterError as error:
+            await ctx.reply(str(error))
+            return
+        if num_messages is not None and len(rest) == 1 and rest[0].isdigit():
+            num_messages = int(rest[0])
+        elif rest:
+            await ctx.reply("I don't understand {}.".format(
+                utils.pretty_list(rest, bold=False)))
+            return
+
+        self.bot.jobs.start(job_id, self.run_purge(ctx, selected, num_messages))
+
+    async def run_purge(self, ctx, selected, num_messages):
+        notice = await ctx.send("Starting mass deletion...")
+        pinned_ids = set(m.id for m in await ctx.pins())
+        purge = ChannelPurge(ctx.channel, notice, pinned_ids, num_messages, selected,
+                             SCAN_BUDGET if selected else None)
+        try:
+            await purge.run()
+        except asyncio.CancelledError:
+            await purge.reporter.finish("Stopped. " + purge.summary())
+            raise
+        except Exception as e:
+            await purge.reporter.finish("{} Stopped by an error: {}".format(purge.summary(), e))
+            raise
+        await purge.reporter.finish(purge.summary())
+
+
+    async def archive_channel(self, ctx, purge):
+        # Shares its job ID with deletions, so the two never overlap.
+        job_id = ('delete', ctx.channel.id)
+        if job_id in self.bot.jobs:
             await ctx.reply("Deletion already in progress, be patient.")
             return
+        self.bot.jobs.start(job_id, self.run_archive(ctx, purge))
 
+    async def run_archive(self, ctx, purge):
+        notice = await ctx.send("Archiving this channel...")
+        saved = channelarchive.ChannelArchive(self.bot.loop, ctx.channel, notice)
         try:
-            self.deleting.add(channel.id)
-            deletion_notice = await ctx.send("Starting mass deletion...")
-            pinned_ids = set(m.id for m in await ctx.pins())
+            await saved.run()
+        except asyncio.CancelledError:
+            await saved.reporter.finish("Stopped. " + saved.summary())
+            raise
+        await saved.reporter.finish(saved.summary())
+        if not purge:
+            return
 
-            def check(m):
-                return m.id != deletion_notice.id and m.id not in pinned_ids
+        # Delete exactly what was archived: everything before the notice.
+        pinned_ids = set(m.id for m in await ctx.pins())
+        deletion = ChannelPurge(ctx.channel, notice, pinned_ids, None)
+        try:
+            await deletion.run()
+        except asyncio.CancelledError:
+            await deletion.reporter.finish(
+                "{} Stopped. {}".format(saved.summary(), deletion.summary()))
+            raise
+        except Exception as e:
+            await deletion.reporter.finish("{} {} Stopped by an error: {}".format(
+                saved.summary(), deletion.summary(), e))
+            raise
+        await deletion.reporter.finish("{} {}".format(saved.summary(), deletion.summary()))
 
-            deleted_so_far = 0
-            while channel.id in self.deleting:
-                msg = "Deletion in progress ({}/{})..."
-                await deletion_notice.edit(content=msg.format(deleted_so_far, num_messages or '\u221E'))
 
-                limit = 100 if num_messages is None else num_messages - deleted_so_far
-                deleted = await channel.purge(limit=limit, check=check, before=deletion_notice)
-                deleted_so_far += len(deleted)
+class ChannelPurge:
+    """Deletes messages from a channel, streaming its history once.
 
-                if not deleted:
-                    break
+    Discord only bulk-deletes messages younger than two weeks, so the
+    history is split as it's read: recent messages are deleted in
+    chunks of 100, older ones one by one. Each kind has its own rate
+    limit, so each gets its own workers. Cancelling `run` stops them
+    all.
 
-            await deletion_notice.edit(content="Deleted {} messages.".format(deleted_so_far))
+    If a filter is given, only matching messages are deleted, up to
+    `limit` of them, and at most `budget` messages are looked at.
+    """
+
+    def __init__(self, channel, notice, skip_ids, limit, selected=None, budget=None):
+        self.channel = channel
+        self.notice = notice
+        self.skip_ids = skip_ids
+        self.limit = limit
+        self.selected = selected or messagefilters.MessageFilter()
+        self.budget = budget
+        self.reporter = progress.ProgressReporter(notice, self.progress)
+        self.scanned = 0
+        self.matched = 0
+        self.deleted = 0
+        # The last message looked at, if the budget ran out.
+        self.stopped_at = None
+        self.done_scanning = False
+        self.started = time.monotonic()
+        self._chunks = asyncio.Queue(maxsize=2)
+        self._singles = asyncio.Queue(maxsize=100)
+
+    async def run(self):
+        scanner = asyncio.ensure_future(self.scan())
+        workers = [asyncio.ensure_future(self.delete_chunks())]
+        workers += [asyncio.ensure_future(self.delete_singles())
+                    for _ in range(SINGLE_DELETE_WORKERS)]
+        try:
+            await asyncio.gather(*workers)
+            # Raises whatever ended the scan early, if anything.
+            await scanner
         finally:
-            if channel.id in self.deleting:
-                self.deleting.remove(channel.id)
+            for task in [scanner] + workers:
+                task.cancel()
+
+    async def scan(self):
+        cancelled = False
+        try:
+            await self.read_history()
+        except asyncio.CancelledError:
+            cancelled = True
+            raise
+        finally:
+            self.done_scanning = True
+            # Even if reading the history failed, let the workers delete
+            # what's queued and stop. If everything is being cancelled,
+            # nobody would take these off the queues.
+            if not cancelled:
+                await self._chunks.put(None)
+                for _ in range(SINGLE_DELETE_WORKERS):
+                    await self._singles.put(None)
+
+    async def read_history(self):
+        cutoff = datetime.datetime.utcnow() - BULK_DELETE_MAX_AGE
+        chunk = []
+        selected = self.selected
+        after = selected.after
+        # Never reach the notice itself, even given a later `before:`.
+        before = self.notice
+        if selected.before is not None and selected.before < self.notice.created_at:
+            before = selected.before
+        history = self.channel.history(limit=None, before=before)
+        last = None
+        async for message in history:
+            if self.matched == self.limit or (after and message.created_at <= after):
+                break
+            if self.scanned == self.budget:
+                self.stopped_at = last
+                break
+            self.scanned += 1
+            last = message
+            if message.id in self.skip_ids or not selected(message):
+                continue
+            self.matched += 1
+            if message.created_at > cutoff:
+                chunk.append(message)
+                if len(chunk) == 100:
+                    await self._chunks.put(chunk)
+                    chunk = []
+            else:
+                await self._singles.put(message)
+        if chunk:
+            await self._chunks.put(chunk)
+
+    async def delete_chunks(self):
+        while True:
+            chunk = await self._chunks.get()
+            if chunk is None:
+                return
+            await self.channel.delete_messages(chunk)
+            self.deleted += len(chunk)
+            self.reporter.update()
+
+    async def delete_singles(self):
+        while True:
+            message = await self._singles.get()
+            if message is None:
+                return
+            try:
+                await message.delete()
+            except discord.NotFound:
+                pass
+            self.deleted += 1
+            self.reporter.update()
+
+    def progress(self):
+        message = "Deletion in progress ({}/{})...".format(
+            self.deleted, self.limit or '\u221E')
+        elapsed = time.monotonic() - self.started
+        if not self.deleted or not elapsed:
+            return message
+        # The scan runs only a little ahead of the deletions, so until
+        # it's done the total is only known if there's a limit.
+        if self.done_scanning:
+            left = self.matched - self.deleted
+        elif self.limit is not None:
+            left = self.limit - self.deleted
+        else:
+            left = None
+        rate = self.deleted / elapsed
+        if left is None:
+            message += " Deleting about {} messages a minute.".format(int(rate * 60))
+        elif left > 0:
+            message += " About {} left.".format(utils.pretty_duration(max(1, left / rate)))
+        return message
+
+    def summary(self):
+        message = "Deleted {} messages.".format(self.deleted)
+        if self.stopped_at is not None:
+            message += (" I gave up after looking at {} messages; add `before:{}` "
+                        "to keep going.").format(self.scanned, self.stopped_at.id)
+        return message
@@ -1,71 +1,570 @@
+import asyncio
+import collections
+import csv
+import io
 import re
 
 import discord
 from discord.ext import commands
 
+import formatter
+import preflight
+import progress
 from rolecog import RoleCog
+import roleexpr
+import roleindex
 import utils
 
-ROLE_PREFIX = utils.setting('AUTO_ROLE_PREFIX', '(Auto)')
-ROLE_REGEX = re.compile(re.escape(ROLE_PREFIX) +
-                        r' *([^ ].+[^ ] *(\+ *[^ ].+[^ ])*)', re.I)
+JOB_WORKERS = utils.setting('AUTO_ROLE_JOB_WORKERS', 4)
+# Seconds between saves of an autoroles run's progress.
+CHECKPOINT_INTERVAL = 5
+# Seconds to wait for more role changes before evaluating a member.
+DEBOUNCE_DELAY = 1
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS autorole_jobs (
+    guild_id INTEGER PRIMARY KEY,
+    cursor INTEGER NOT NULL,
+    updated INTEGER NOT NULL,
+    failed INTEGER NOT NULL
+);
+'''
+
+
+class RuleSet:
+    """The auto roles of one guild, indexed by their prerequisites.
+
+    Each auto role is stored with its rule compiled against the guild's
+    role index, and every role name (or ID) mentioned in a rule points
+    back at the auto roles depending on it. A change to a member's
+    roles then only needs to look at the rules that mention one of the
+    changed roles.
+
+    Rules may depend on other auto roles (referred to by ID), so they
+    are evaluated in topological order. Auto roles whose rules depend
+    on each other in a loop can't be ordered and are left alone.
+    """
+
+    def __init__(self, index):
+        self.index = index
+        # auto role -> (tokens depended on, compiled roleexpr.Rule)
+        self.rules = {}
+        # token -> set of auto roles depending on it
+        self.dependents = collections.defaultdict(set)
+        # Topological order of the rules and the set of rules that
+        # couldn't be ordered; computed lazily.
+        self._order = None
+        self._cyclic = set()
+
+    def add(self, role, expr):
+        self.remove(role)
+        rule = roleexpr.compile(expr, self.index)
+        tokens = set(rule.names)
+        # A member granted or stripped of the auto role by hand needs
+        # re-checking too.
+        tokens.add(str(role.id))
+        for token in tokens:
+            self.dependents[token].add(role)
+        self.rules[role] = (tokens, rule)
+        self._order = None
+
+    def remove(self, role):
+        if role not in self.rules:
+            return
+        tokens, _ = self.rules.pop(role)
+        self._order = None
+        for token in tokens:
+            dependents = self.dependents[token]
+            dependents.discard(role)
+            if not dependents:
+                del self.dependents[token]
+
+    def affected_by(self, changed_roles):
+        affected = set()
+        for role in changed_roles:
+            for token in roleindex.role_tokens(role):
+                affected.update(self.dependents.get(token, ()))
+        return affected
+
+    def order(self):
+        if self._order is None:
+            self._order, self._cyclic = self._sort()
+        return self._order
+
+    def cyclic(self):
+        self.order()
+        return self._cyclic
+
+    def _sort(self):
+        # An edge runs from each auto role to the rules mentioning it.
+        providers = collections.defaultdict(set)
+        for role in self.rules:
+            for token in roleindex.role_tokens(role):
+                providers[token].add(role)
+
+        edges = {role: set() for role in self.rules}
+        indegree = dict.fromkeys(self.rules, 0)
+        for role, (_, rule) in self.rules.items():
+            for name in rule.names:
+                for provider in providers.get(name, ()):
+                    if role not in edges[provider]:
+                        edges[provider].add(role)
+                        indegree[role] += 1
+
+        ready = collections.deque(
+            role for role, degree in indegree.items() if degree == 0)
+        order = []
+        while ready:
+            role = ready.popleft()
+            order.append(role)
+            for dependent in edges[role]:
+                indegree[dependent] -= 1
+                if indegree[dependent] == 0:
+                    ready.append(dependent)
+
+        return order, set(self.rules) - set(order)
+
+    def resolve(self, roles, changed_roles=None, mask=None):
+        """Adds and removes auto roles to a set of roles as needed.
+
+        Only rules affected by the given changed roles are checked, or
+        all of them if none are given. Granting or revoking an auto
+        role brings the rules depending on it into play, so the result
+        already accounts for chains of auto roles.
+        """
+        if changed_roles is None:
+            affected = set(self.rules)
+        else:
+            affected = self.affected_by(changed_roles)
+
+        roles = set(roles)
+        if mask is None:
+            mask = self.index.mask_for_roles(roles)
+
+        for role in self.order():
+            if role not in affected:
+                continue
+            _, rule = self.rules[role]
+            qualifies = rule.matches(mask)
+            if qualifies == (role in roles):
+                continue
+            if qualifies:
+                roles.add(role)
+                mask |= self.index.mask_for_roles([role])
+            else:
+                roles.remove(role)
+                mask = self.index.mask_for_roles(roles)
+            affected.update(self.affected_by([role]))
+
+        return roles
+
+    def evaluate(self, member, changed_roles=None):
+        """Works out which auto roles a member should gain and lose.
+        """
+        original = set(member.roles)
+        # Not through the cached views: planning looks at every member
+        # of a guild once, and would only flush them.
+        roles = self.resolve(original, changed_roles)
+        return list(roles - original), list(original - roles)
+
+    def plan(self, members):
+        """Evaluates every rule for many members at once.
+
+        Each role name or ID is turned into a column: an integer whose
+        i-th bit says whether `members[i]` has it. Rules are then
+        evaluated a whole column at a time. Returns a list of
+        `(auto role, adds, removes)`, where `adds` and `removes` are
+        columns of the members who would gain or lose the role.
+        """
+        auto_ids = set(role.id for role in self.rules)
+        wanted = set()
+        for _, rule in self.rules.values():
+            wanted.update(rule.names)
+
+        # role ID -> bytearrays of the columns the role contributes to.
+        # Auto roles only contribute to their own column here; their
+        # names are filled in as the rules are evaluated.
+        size = (len(members) + 7) // 8
+        columns = {}
+        contributions = {}
+
+        def column(token):
+            bit = self.index.bit(token)
+            if bit not in columns:
+                columns[bit] = bytearray(size)
+            return columns[bit]
+
+        def contributes_to(role):
+            if role.id in auto_ids:
+                return [column(str(role.id))]
+            return [column(token) for token in roleindex.role_tokens(role)
+                    if token in wanted]
+
+        for i, member in enumerate(members):
+            byte, flag = i >> 3, 1 << (i & 7)
+            for role in member.roles:
+                targets = contributions.get(role.id)
+                if targets is None:
+                    targets = contributions[role.id] = contributes_to(role)
+                for target in targets:
+                    target[byte] |= flag
+
+        columns = {bit: int.from_bytes(col, 'little')
+                   for bit, col in columns.items()}
+        everyone = (1 << len(members)) - 1
+
+        def held(role):
+            return columns.get(self.index.bit(str(role.id)), 0)
+
+        def grant(role, col):
+            name_bit, id_bit = (self.index.bit(token)
+                                for token in roleindex.role_tokens(role))
+            columns[name_bit] = columns.get(name_bit, 0) | col
+            columns[id_bit] = col
+
+        def evaluate(rule):
+            result = 0
+            for required, forbidden in rule.terms:
+                col = everyone
+                for bit in _bits(required):
+                    col &= columns.get(bit, 0)
+                for bit in _bits(forbidden):
+                    col &= ~columns.get(bit, 0)
+                result |= col
+            return result & everyone
+
+        for role in self.cyclic():
+            grant(role, held(role))
+
+        results = []
+        for role in self.order():
+            _, rule = self.rules[role]
+            before = held(role)
+            after = evaluate(rule)
+            grant(role, after)
+            results.append((role, after & ~before, before & ~after))
+        return results
+
+
+def _changing(to_add, to_remove):
+    def change(roles):
+        return (roles - set(to_remove)) | set(to_add)
+    return change
+
+
+def _bits(mask):
+    while mask:
+        bit = mask & -mask
+        yield bit
+        mask ^= bit
+
+
+def _members_in(members, col):
+    data = col.to_bytes((len(members) + 7) // 8, 'little')
+    for i, byte in enumerate(data):
+        while byte:
+            flag = byte & -byte
+            yield members[i * 8 + flag.bit_length() - 1]
+            byte ^= flag
+
+
+def _count(col):
+    return bin(col).count('1')
+
+
+class AutoroleJob:
+    """The state of a retroactive auto role run over a guild.
+
+    `plan` lists `(member ID, roles to add, roles to remove)` in member
+    ID order. Edits finish out of order, but every member up to
+    `cursor` is known to be done, so an interrupted run can be resumed
+    from there.
+    """
+
+    def __init__(self, plan, cursor=0, updated=0, failed=0):
+        self.plan = plan
+        self.cursor = cursor
+        self.updated = updated
+        self.failed = failed
+        self.finished = 0
+        # Shared by all the workers applying the plan.
+        self.pending = iter(enumerate(plan))
+        self._done = [False] * len(plan)
+        self._watermark = 0
+
+    def mark_done(self, i, updated=False, failed=False):
+        self._done[i] = True
+        self.finished += 1
+        self.updated += 1 if updated else 0
+        self.failed += 1 if failed else 0
+        while self._watermark < len(self.plan) and self._done[self._watermark]:
+            self.cursor = self.plan[self._watermark][0]
+            self._watermark += 1
+
+    def progress(self):
+        message = "Applying auto roles ({}/{})..."
+        return message.format(self.finished, len(self.plan))
+
+    def summary(self):
+        message = "Updated roles on {} users."
+        if self.failed:
+            message += " ({} couldn't be updated.)"
+        return message.format(self.updated, self.failed)
 
 
 class AutoRoles(RoleCog, name='Auto Roles'):
+    role_settings = ('auto_role_prefix',)
+
+    def role_prefix(self, guild):
+        return self.bot.settings.get(guild, 'auto_role_prefix')
+
+    def role_regex(self, guild):
+        return self.bot.settings.derived(guild, 'auto_role_regex', lambda: re.compile(
+            re.escape(self.role_prefix(guild)) + r' *(.*[^ ])', re.I))
+
     def key_for_role(self, role):
-        name = role.name.lower()
-        m = ROLE_REGEX.fullmatch(name)
+        m = self.role_regex(role.guild).fullmatch(role.name)
         if m:
-            role_names = tuple(part.strip() for part in m.group(1).split('+'))
-            return role_names
+            try:
+                expr = roleexpr.parse(m.group(1))
+                # Expressions too complex to use are only found out
+                # when compiling them.
+                roleexpr.compile(expr, roleindex.RoleIndex())
+            except roleexpr.ParseError:
+                return None
+            return expr
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self._processing = set()
+        # (guild ID, member ID) -> roles changed since the last evaluation
+        self._pending = {}
+        # guild -> RuleSet
+        self._rules = {}
+        self.bot.storage.declare(SCHEMA)
+        self.bot.reconciler.register(self.resolve_roles)
 
-    @commands.command()
+    def rules_for(self, guild):
+        rules = self._rules.get(guild)
+        if rules is None:
+            rules = self._rules[guild] = RuleSet(self.bot.role_views.for_guild(guild))
+        return rules
+
+    def _sync_role(self, role):
+        super()._sync_role(role)
+        key = self.key_for_role(role)
+        if key:
+            self.rules_for(role.guild).add(role, key)
+
+    def _remove_role(self, role):
+        super()._remove_role(role)
+        self.rules_for(role.guild).remove(role)
+
+    def _forget_guild(self, guild):
+        super()._forget_guild(guild)
+        self._rules.pop(guild, None)
+
+    @commands.group(invoke_without_command=True)
     @commands.has_permissions(administrator=True)
     async def autoroles(self, ctx):
         """Apply automatic roles retroactively. (admin only)
 
         You should only have to do this once. Auto roles should apply
         automatically whenever roles change once the bot is online.
+        Large guilds are updated in the background; the run can be
+        cancelled and resumed later.
         """
-        fixed = 0
-        for member in ctx.message.guild.members:
-            changed = await self.autorole_member(member)
-            fixed += 1 if changed else 0
-        message = "Updated roles on {} users."
-        await ctx.reply(message.format(fixed))
-
-    async def autorole_member(self, member):
-        self._processing.add(member.id)
-        role_names = set(role.name.lower() for role in member.roles)
-        to_remove, to_add = [], []
-        for (req1, req2), role in self.roles_by_key(member.guild):
-            if req1 in role_names and req2 in role_names:
-                to_add.append(role)
-            elif role in member.roles:
-                to_remove.append(role)
-
-        changed = False
-        if to_add or to_remove:
-            updated_roles = (set(member.roles) - set(to_remove)) | set(to_add)
-            await member.edit(roles=list(updated_roles))
-            changed = True
-
-        self._processing.remove(member.id)
-        return changed
+        await self.start_job(ctx)
+
+    @autoroles.command(name='resume')
+    @commands.has_permissions(administrator=True)
+    async def autoroles_resume(self, ctx):
+        """Resume an interrupted autoroles run. (admin only)
+        """
+        row = await self.bot.storage.fetchone(
+            'SELECT cursor, updated, failed FROM autorole_jobs WHERE guild_id = ?',
+            (ctx.guild.id,))
+        if row is None:
+            await ctx.reply("There's no interrupted autoroles run to resume.")
+        else:
+            await self.start_job(ctx, *row)
+
+    @autoroles.command(name='plan')
+    @commands.has_permissions(administrator=True)
+    async def autoroles_plan(self, ctx):
+        """Preview what autoroles would change. (admin only)
+
+        Nothing is changed. The affected members are attached as a
+        CSV file.
+        """
+        guild = ctx.guild
+        members = sorted(guild.members, key=lambda m: m.id)
+        results = self.rules_for(guild).plan(members)
+
+        message = formatter.TextBlock()
+        rows = []
+        for role, adds, removes in results:
+            if not adds and not removes:
+                continue
+            message.add_line('`{}`: {} to add, {} to remove'.format(
+                role.name, _count(adds), _count(removes)))
+            for action, col in (('add', adds), ('remove', removes)):
+                for member in _members_in(members, col):
+                    rows.append((member.id, str(member), role.id, role.name, action))
+
+        if not rows:
+            await ctx.reply("Auto roles are already up to date.")
+            return
+
+        f = io.StringIO()
+        writer = csv.writer(f)
+        writer.writerow(('member_id', 'member', 'role_id', 'role', 'action'))
+        writer.writerows(rows)
+        attachment = discord.File(io.BytesIO(f.getvalue().encode('utf-8')),
+                                  filename='autoroles-plan.csv')
+
+        pages = message.render_pages(max_size=2000)
+        for page in pages[:-1]:
+            await ctx.send(page)
+        await ctx.send(pages[-1], file=attachment)
+
+    @autoroles.command(name='cancel')
+    @commands.has_permissions(administrator=True)
+    async def autoroles_cancel(self, ctx):
+        """Stop an in-progress autoroles run. (admin only)
+        """
+        if not self.bot.jobs.cancel(('autoroles', ctx.guild.id)):
+            await ctx.reply("No autoroles run in progress.")
+        else:
+            await ctx.reply("Stopped applying auto roles. "
+                            "Use `autoroles resume` to pick up where it left off.")
+
+    async def start_job(self, ctx, cursor=0, updated=0, failed=0):
+        job_id = ('autoroles', ctx.guild.id)
+        if job_id in self.bot.jobs:
+            await ctx.reply("Auto roles are already being applied, be patient.")
+            return
+        self.bot.jobs.start(job_id, self.run_job(ctx, cursor, updated, failed))
+
+    async def run_job(self, ctx, cursor=0, updated=0, failed=0):
+        guild = ctx.guild
+        notice = await ctx.send("Planning auto role changes...")
+        plan = await self.plan_guild(guild, after=cursor)
+        job = AutoroleJob(plan, cursor, updated, failed)
+        await self.save_checkpoint(guild, job)
+
+        reporter = progress.ProgressReporter(notice, job.progress)
+        checkpoints = self.bot.loop.create_task(self.save_checkpoints(guild, job))
+        try:
+            await asyncio.gather(*[self.apply_plan(guild, job, reporter)
+                                   for _ in range(JOB_WORKERS)])
+        except asyncio.CancelledError:
+            await self.save_checkpoint(guild, job)
+            await reporter.finish("Stopped. " + job.summary())
+            raise
+        finally:
+            checkpoints.cancel()
+
+        await self.bot.storage.execute(
+            'DELETE FROM autorole_jobs WHERE guild_id = ?', (guild.id,))
+        await reporter.finish(job.summary())
+
+    async def plan_guild(self, guild, after=0):
+        """Works out the auto role changes needed for every member of a
+        guild with an ID greater than `after`, in member ID order.
+        """
+        rules = self.rules_for(guild)
+        plan = []
+        members = sorted(guild.members, key=lambda m: m.id)
+        for i, member in enumerate(members):
+            if member.id <= after:
+                continue
+            to_add, to_remove = rules.evaluate(member)
+            if to_add or to_remove:
+                plan.append((member.id, to_add, to_remove))
+            # Planning a big guild takes a while; don't hog the loop.
+            if i % 1000 == 999:
+                await asyncio.sleep(0)
+        return plan
+
+    async def apply_plan(self, guild, job, reporter):
+        # Several of these run concurrently. Member edits within a guild
+        # share a rate limit bucket, which the HTTP client waits on for
+        # us, so a handful of workers is enough to keep it saturated.
+        for i, (member_id, to_add, to_remove) in job.pending:
+            member = guild.get_member(member_id)
+            if member is None:
+                job.mark_done(i)
+                continue
+            try:
+                await self.bot.reconciler.update(
+                    member, _changing(to_add, to_remove), delay=0)
+            except (discord.HTTPException, preflight.PreflightError):
+                job.mark_done(i, failed=True)
+            else:
+                job.mark_done(i, updated=True)
+            reporter.update()
+
+    async def save_checkpoints(self, guild, job):
+        while True:
+            await asyncio.sleep(CHECKPOINT_INTERVAL)
+            await self.save_checkpoint(guild, job)
+
+    async def save_checkpoint(self, guild, job):
+        await self.bot.storage.execute(
+            'INSERT OR REPLACE INTO autorole_jobs (guild_id, cursor, updated, failed) '
+            'VALUES (?, ?, ?, ?)',
+            (guild.id, job.cursor, job.updated, job.failed))
+
+    def resolve_roles(self, member, roles, changed_roles):
+        # Contributed to the bot's role reconciler, so that auto roles
+        # are folded into every other module's edits.
+        return self.rules_for(member.guild).resolve(roles, changed_roles)
+
+    async def autorole_member(self, member, changed_roles=None):
+        if changed_roles is None:
+            changed_roles = self.rules_for(member.guild).rules.keys()
+        try:
+            await self.bot.reconciler.update(member, touched=changed_roles)
+        except preflight.PreflightError:
+            # Nobody to tell; the auto role will be applied once the
+            # bot's roles allow it.
+            pass
 
     @commands.Cog.listener()
     async def on_member_update(self, before, after):
-        if before.id in self._processing:
-            return
         if before.roles == after.roles:
             return
-        await self.autorole_member(after)
+
+        # Our own edits come back as updates too, but auto roles were
+        # already accounted for when making them.
+        if self.bot.reconciler.is_own_update(after):
+            return
+        key = (after.guild.id, after.id)
+
+        changed = set(before.roles).symmetric_difference(after.roles)
+        if not self.rules_for(after.guild).affected_by(changed):
+            return
+
+        # Bulk changes (like `join all`) arrive as a burst of updates;
+        # collect them and evaluate the member once, as they are after
+        # the burst.
+        pending = self._pending.get(key)
+        if pending is not None:
+            pending.update(changed)
+            return
+        self._pending[key] = changed
+        await asyncio.sleep(DEBOUNCE_DELAY)
+        changed = self._pending.pop(key)
+
+        member = after.guild.get_member(after.id)
+        if member is not None:
+            await self.autorole_member(member, changed)
 
     def adminhelp(self, ctx):
+        guild = ctx.message.guild
+        return self.cached(guild, 'adminhelp', lambda: self._adminhelp(guild))
+
+    def _adminhelp(self, guild):
         desc = ("This module automatically assigns and removes a role based on "
                 "the other roles of a user. It can be used to create channels "
                 "only visible to users who have *several* particular roles.")
@@ -74,10 +573,26 @@ class AutoRoles(RoleCog, name='Auto Roles'):
                  "consists of the prefix `{0}` followed by two or more role names "
                  "separated with `+` signs. For instance, a role named "
                  "`{0} Cool People + adults` will be applied to users with both "
-                 "the `cool people` role and the `adults` role.").format(ROLE_PREFIX)
+                 "the `cool people` role and the `adults` role.").format(
+                     self.role_prefix(guild))
+        desc += '\n\n'
+        desc += ("Role names can also be combined with `|` (either role will do) "
+                 "and `!` (must *not* have the role), grouped with parentheses. "
+                 "For instance, `{0} (artists | writers) + !muted`. Roles whose "
+                 "names contain any of `+|!()`, including other auto roles, can "
+                 "be referred to by their ID instead.").format(
+                     self.role_prefix(guild))
         desc += '\n\n'
         desc += "Currently recognized auto roles: {}.".format(
-            utils.pretty_list(['`{}`'.format(role.name) for role in self.all_roles(ctx.message.guild)],
+            utils.pretty_list(['`{}`'.format(role.name) for role in self.all_roles(guild)],
                               bold=False, empty='none')
         )
+        cyclic = self.rules_for(guild).cyclic()
+        if cyclic:
+            desc += '\n\n'
+            desc += ("These auto roles depend on each other in a loop and are "
+                     "being ignored: {}.").format(
+                utils.pretty_list(['`{}`'.format(role.name) for role in cyclic],
+                                  bold=False)
+            )
         return desc
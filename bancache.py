@@ -0,0 +1,101 @@
+import asyncio
+import bisect
+
+
+class BanList:
+    """The users banned from one guild.
+
+    The list is fetched from Discord once, then kept current from ban
+    and unban events. Bans and unbans that happen while it's being
+    fetched take precedence over whatever the fetch returns.
+    """
+
+    def __init__(self):
+        # user ID -> User
+        self.users = {}
+        self.loaded = False
+        self._lock = asyncio.Lock()
+        # IDs of users banned or unbanned while loading.
+        self._changed = set()
+        # Sorted (lowercased name, user ID) pairs, for prefix search.
+        self._names = None
+
+    def __len__(self):
+        return len(self.users)
+
+    def __contains__(self, user_id):
+        return user_id in self.users
+
+    async def load(self, guild):
+        async with self._lock:
+            if self.loaded:
+                return
+            self._changed = set()
+            for entry in await guild.bans():
+                if entry.user.id not in self._changed:
+                    self.users[entry.user.id] = entry.user
+            self._changed = None
+            self._names = None
+            self.loaded = True
+
+    def add(self, user):
+        self.users[user.id] = user
+        self._changed_user(user)
+
+    def remove(self, user):
+        self.users.pop(user.id, None)
+        self._changed_user(user)
+
+    def _changed_user(self, user):
+        if self._changed is not None:
+            self._changed.add(user.id)
+        self._names = None
+
+    def sorted(self):
+        return sorted(self.users.values(), key=lambda user: user.id)
+
+    def search(self, text):
+        """Finds banned users by ID, or by the start of their name.
+        """
+        if text.isdigit() and int(text) in self.users:
+            return [self.users[int(text)]]
+
+        if self._names is None:
+            self._names = sorted((str(user).lower(), user.id)
+                                 for user in self.users.values())
+        prefix = text.lower()
+        i = bisect.bisect_left(self._names, (prefix,))
+        found = []
+        while i < len(self._names) and self._names[i][0].startswith(prefix):
+            found.append(self.users[self._names[i][1]])
+            i += 1
+        return found
+
+
+class BanCache:
+    """Ban lists of all the bot's guilds, loaded as they're needed.
+    """
+
+    def __init__(self):
+        # guild ID -> BanList
+        self._lists = {}
+
+    async def get(self, guild):
+        bans = self._lists.get(guild.id)
+        if bans is None:
+            bans = self._lists[guild.id] = BanList()
+        await bans.load(guild)
+        return bans
+
+    def add(self, guild, user):
+        bans = self._lists.get(guild.id)
+        if bans is not None:
+            bans.add(user)
+
+    def remove(self, guild, user):
+        bans = self._lists.get(guild.id)
+        if bans is not None:
+            bans.remove(user)
+
+    def forget(self, guild):
+        self._lists.pop(guild.id, None)
@@ -0,0 +1,73 @@
+import datetime
+import gzip
+import json
+import os
+
+import progress
+import utils
+
+ARCHIVE_PATH = utils.setting('ARCHIVE_PATH', 'archives')
+
+
+def message_record(message):
+    return {
+        'id': message.id,
+        'author_id': message.author.id,
+        'author': str(message.author),
+        'created_at': message.created_at.isoformat(),
+        'edited_at': message.edited_at and message.edited_at.isoformat(),
+        'content': message.content,
+        'attachments': [attachment.url for attachment in message.attachments],
+        'embeds': [embed.to_dict() for embed in message.embeds],
+        'pinned': message.pinned,
+    }
+
+
+class ChannelArchive:
+    """Saves a channel's history to a gzipped JSON Lines file.
+
+    The history is streamed a page at a time, and each page is written
+    out and flushed before the next one is read, so memory use doesn't
+    depend on the size of the channel. Messages are written newest
+    first, starting from the one before `notice`.
+    """
+
+    def __init__(self, loop, channel, notice):
+        self.loop = loop
+        self.channel = channel
+        self.notice = notice
+        self.archived = 0
+        self.reporter = progress.ProgressReporter(notice, self.progress)
+        timestamp = datetime.datetime.utcnow().strftime('%Y%m%d-%H%M%S')
+        self.filename = '{}-{}-{}.jsonl.gz'.format(channel.guild.id, channel.id, timestamp)
+        self.path = os.path.join(ARCHIVE_PATH, self.filename)
+
+    async def run(self):
+        os.makedirs(ARCHIVE_PATH, exist_ok=True)
+        f = gzip.open(self.path, 'wt', encoding='utf-8')
+        try:
+            page = []
+            async for message in self.channel.history(limit=None, before=self.notice):
+                page.append(json.dumps(message_record(message)) + '\n')
+                # The history iterator fetches 100 messages at a time.
+                if len(page) == 100:
+                    await self.write(f, page)
+                    page = []
+            if page:
+                await self.write(f, page)
+        finally:
+            await self.loop.run_in_executor(None, f.close)
+
+    async def write(self, f, lines):
+        def write():
+            f.writelines(lines)
+            f.flush()
+        await self.loop.run_in_executor(None, write)
+        self.archived += len(lines)
+        self.reporter.update()
+
+    def progress(self):
+        return "Archiving this channel ({} messages so far)...".format(self.archived)
+
+    def summary(self):
+        return "Archived {} messages to `{}`.".format(self.archived, self.filename)
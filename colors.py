@@ -8,16 +8,13 @@ import wand
 from wand import color, image
 
 import colornames
+import guildsettings
+import progress
 from rolecog import RoleCog
-import utils
 
-MIN_LUMINANCE = utils.setting('COLORS_MIN_LUMINANCE', 0.15)
-MAX_LUMINANCE = utils.setting('COLORS_MAX_LUMINANCE', 0.75)
-LIMIT_PALETTE = utils.setting('COLORS_LIMIT_PALETTE', False)
-ROLE_PREFIX = utils.setting('COLORS_ROLE_PREFIX',   '')
-
-LUMINANCE_RANGE = (MIN_LUMINANCE, MAX_LUMINANCE)
-ROLE_REGEX = re.compile(re.escape(ROLE_PREFIX) + '(#[a-fA-F0-9]{6})')
+# The luminance limits of guilds that haven't changed them.
+LUMINANCE_RANGE = (guildsettings.SETTINGS['colors_min_luminance'].default,
+                   guildsettings.SETTINGS['colors_max_luminance'].default)
 
 
 def generate_swatch(color, w=200, h=30):
@@ -124,6 +121,24 @@ def clamp_luminance(color, *, luminance_range=LUMINANCE_RANGE):
         return color
 
 
+def allowed_color(color, *, luminance_range, limit_palette):
+    """Fits a color to the palette and luminance limits.
+
+    Returns the adjusted color, along with 'light' or 'dark' if it had
+    to be darkened or brightened (or None if it didn't).
+    """
+    if limit_palette:
+        color = rgb9(color)
+
+    clamped_color = clamp_luminance(color, luminance_range=luminance_range)
+    reason = None
+    if clamped_color.value < color.value:
+        reason = 'light'
+    elif clamped_color.value > color.value:
+        reason = 'dark'
+    return clamped_color, reason
+
+
 _hexcolor = re.compile('#?([0-9A-Fa-f]{3}|[0-9A-Fa-f]{6})')
 
 
@@ -164,39 +179,64 @@ class Colors(RoleCog, name="Colors"):
     color codes (#XXXXXX) and can be shared between multiple users.
     """
 
+    sticky = True
+    role_settings = ('color_role_prefix',)
+
+    def role_regex(self, guild):
+        settings = self.bot.settings
+        return settings.derived(guild, 'color_role_regex', lambda: re.compile(
+            re.escape(settings.get(guild, 'color_role_prefix')) + '(#[a-fA-F0-9]{6})'))
+
+    def allowed_color(self, guild, color):
+        settings = self.bot.settings
+        luminance_range = (settings.get(guild, 'colors_min_luminance'),
+                           settings.get(guild, 'colors_max_luminance'))
+        return allowed_color(color, luminance_range=luminance_range,
+                             limit_palette=settings.get(guild, 'colors_limit_palette'))
+
     def adminhelp(self, ctx):
+        guild = ctx.message.guild
+        return self.cached(guild, 'adminhelp', lambda: self._adminhelp(guild))
+
+    def _adminhelp(self, guild):
         desc = ("This module lets users assign themselves colors. Currently there are {} "
                 "color roles in existence. If this seems too high, you can get rid of roles "
                 "nobody is using with the `purgecolors` command.").format(
-                    len(list(self.all_roles(ctx.message.guild)))
+                    len(list(self.all_roles(guild)))
         )
         return desc
 
     def key_for_role(self, role):
-        m = ROLE_REGEX.fullmatch(role.name)
+        m = self.role_regex(role.guild).fullmatch(role.name)
         if m:
             return m.group(1).lower()
 
     def is_color_role(self, role):
-        return ROLE_REGEX.fullmatch(role.name)
+        return self.role_regex(role.guild).fullmatch(role.name)
 
     async def role_for_color(self, guild, color):
         role = self.get_role(guild, str(color))
         if role is None:
-            name = ROLE_PREFIX + str(color)
+            self.bot.preflight.check_manage_roles(guild)
+            name = self.bot.settings.get(guild, 'color_role_prefix') + str(color)
             role = await guild.create_role(name=name, color=color)
         return role
 
+    async def restore_roles(self, guild, roles):
+        if not roles:
+            return []
+        # The color limits may have changed since the member left.
+        color, _ = self.allowed_color(guild, hex2color(self.key_for_role(roles[0])))
+        return [await self.role_for_color(guild, color)]
+
     async def set_color(self, member, guild, color):
-        old_roles = list(filter(self.is_color_role, member.roles))
-        if color is None:
-            await member.remove_roles(*old_roles)
-        else:
-            new_role = await self.role_for_color(guild, color)
-            old_role_ids = set(r.id for r in old_roles)
-            updated_roles = [
-                r for r in member.roles if r.id not in old_role_ids] + [new_role]
-            await member.edit(roles=updated_roles)
+        new_roles = set()
+        if color is not None:
+            new_roles.add(await self.role_for_color(guild, color))
+
+        def change(roles):
+            return set(r for r in roles if not self.is_color_role(r)) | new_roles
+        await self.bot.reconciler.update(member, change)
 
     @commands.command()
     async def swatch(self, ctx, *, color: str):
@@ -235,17 +275,7 @@ class Colors(RoleCog, name="Colors"):
 
         canonical_name = color_names[0] if color_names else None
 
-        effective_color = desired_color
-        if LIMIT_PALETTE:
-            effective_color = rgb9(effective_color)
-
-        clamped_color = clamp_luminance(effective_color)
-        reason = None
-        if clamped_color.value < effective_color.value:
-            reason = 'light'
-        elif clamped_color.value > effective_color.value:
-            reason = 'dark'
-        effective_color = clamped_color
+        effective_color, reason = self.allowed_color(ctx.guild, desired_color)
 
         await self.set_color(ctx.message.author, ctx.message.guild, effective_color)
 
@@ -280,16 +310,28 @@ class Colors(RoleCog, name="Colors"):
         cleans them up without impacting colors which are in use. The
         process may take several seconds to complete.
         """
-        guild = ctx.message.guild
-        async with ctx.typing():
-            color_roles = list(self.all_roles(guild))
-            used_roles = set(role.id
-                             for member in guild.members
-                             for role in member.roles)
-            unused = [role for role in color_roles if role.id not in used_roles]
-            for role in unused:
-                await role.delete(reason="unused color")
-            await ctx.reply("Removed {} unused color roles.".format(len(unused)))
+        job_id = ('purgecolors', ctx.guild.id)
+        if job_id in self.bot.jobs:
+            await ctx.reply("Already removing unused colors, be patient.")
+            return
+        self.bot.jobs.start(job_id, self.purge_unused(ctx))
+
+    async def purge_unused(self, ctx):
+        guild = ctx.guild
+        used_roles = set(role.id
+                         for member in guild.members
+                         for role in member.roles)
+        unused = [role for role in self.all_roles(guild) if role.id not in used_roles]
+        notice = await ctx.send("Removing {} unused color roles...".format(len(unused)))
+
+        removed = 0
+        reporter = progress.ProgressReporter(notice, lambda: (
+            "Removing unused color roles ({}/{})...".format(removed, len(unused))))
+        for role in unused:
+            await role.delete(reason="unused color")
+            removed += 1
+            reporter.update()
+        await reporter.finish("Removed {} unused color roles.".format(removed))
 
     async def send_swatch(self, ctx, color, content=None, name=None):
         if name:
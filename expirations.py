@@ -0,0 +1,128 @@
+import asyncio
+import collections
+import heapq
+import sys
+import time
+import traceback
+
+import discord
+
+import preflight
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS role_expirations (
+    guild_id INTEGER NOT NULL,
+    member_id INTEGER NOT NULL,
+    role_id INTEGER NOT NULL,
+    expires_at REAL NOT NULL,
+    PRIMARY KEY (guild_id, member_id, role_id)
+);
+'''
+
+
+class RoleExpirations:
+    """Takes roles away from members once they expire.
+
+    Pending expirations are stored in the bot's database, so they
+    survive restarts, and kept in a heap in memory, so the scheduler
+    only ever has to look at the next one due. Roles falling due for
+    the same member at the same time are removed with a single edit.
+    """
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.bot.storage.declare(SCHEMA)
+        # (expires_at, (guild ID, member ID, role ID)); may contain
+        # entries that were since cancelled or rescheduled.
+        self._heap = []
+        # (guild ID, member ID, role ID) -> expires_at
+        self._due = {}
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    async def start(self):
+        if self._task is not None:
+            return
+        rows = await self.bot.storage.fetchall(
+            'SELECT guild_id, member_id, role_id, expires_at FROM role_expirations')
+        for guild_id, member_id, role_id, expires_at in rows:
+            self._push((guild_id, member_id, role_id), expires_at)
+        self._task = self.bot.loop.create_task(self._run())
+
+    def expires_at(self, member, role):
+        return self._due.get((member.guild.id, member.id, role.id))
+
+    async def schedule(self, member, roles, seconds):
+        expires_at = time.time() + seconds
+        keys = [(member.guild.id, member.id, role.id) for role in roles]
+        await self.bot.storage.executemany(
+            'INSERT OR REPLACE INTO role_expirations '
+            '(guild_id, member_id, role_id, expires_at) VALUES (?, ?, ?, ?)',
+            [key + (expires_at,) for key in keys])
+        for key in keys:
+            self._push(key, expires_at)
+
+    async def cancel(self, member, roles):
+        keys = [(member.guild.id, member.id, role.id) for role in roles]
+        keys = [key for key in keys if self._due.pop(key, None) is not None]
+        await self._forget(keys)
+
+    def _push(self, key, expires_at):
+        self._due[key] = expires_at
+        heapq.heappush(self._heap, (expires_at, key))
+        self._wakeup.set()
+
+    async def _forget(self, keys):
+        if keys:
+            await self.bot.storage.executemany(
+                'DELETE FROM role_expirations '
+                'WHERE guild_id = ? AND member_id = ? AND role_id = ?', keys)
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            try:
+                await self._expire_due()
+            except Exception as error:
+                print('Ignoring exception in role expiration', file=sys.stderr)
+                traceback.print_exception(
+                    type(error), error, error.__traceback__, file=sys.stderr)
+
+            timeout = None
+            if self._heap:
+                timeout = max(0, self._heap[0][0] - time.time())
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _expire_due(self):
+        now = time.time()
+        # (guild ID, member ID) -> IDs of roles to remove
+        due = collections.defaultdict(set)
+        while self._heap and self._heap[0][0] <= now:
+            expires_at, key = heapq.heappop(self._heap)
+            if self._due.get(key) == expires_at:
+                del self._due[key]
+                due[key[:2]].add(key[2])
+        if not due:
+            return
+
+        await asyncio.gather(*[self._expire(guild_id, member_id, role_ids)
+                               for (guild_id, member_id), role_ids in due.items()])
+        await self._forget([(guild_id, member_id, role_id)
+                            for (guild_id, member_id), role_ids in due.items()
+                            for role_id in role_ids])
+
+    async def _expire(self, guild_id, member_id, role_ids):
+        guild = self.bot.get_guild(guild_id)
+        member = guild and guild.get_member(member_id)
+        if member is None:
+            return
+
+        def change(roles):
+            return set(role for role in roles if role.id not in role_ids)
+        try:
+            await self.bot.reconciler.update(member, change)
+        except (discord.HTTPException, preflight.PreflightError):
+            pass
@@ -1,34 +1,34 @@
+import asyncio
 import inspect
 import itertools
 import re
 
 import discord
+import discord.ext.commands
 
 # This is all totally overkill, but if want markdown in our help text
 # (rather than the giant code block discord.py uses by default) and
 # still want pagination to work right this seems like the principled
 # approach.
 
+# The permissions command checks in this bot look at. Help only differs
+# between users (and channels) that differ in these.
+PROFILE_PERMISSIONS = ('administrator', 'manage_roles', 'manage_messages',
+                       'ban_members', 'read_message_history')
+
+PAGE_SIZE = 2000
+# Seconds a pager keeps responding after the last page flip.
+PAGER_TIMEOUT = 120
+
 
 class Paginable:
     def size(self):
         raise NotImplementedError
 
-    def split(self, max_size):
-        if self.size() <= max_size:
-            return self, None
-        else:
-            raise RuntimeError('Non-splittable item exceeds maximum size.')
-
     def paginate(self, max_size):
-        current = self
-        parts = []
-        while current.size() >= max_size:
-            first, rest = current.split(max_size)
-            parts.append(first)
-            current = rest
-        parts.append(current)
-        return parts
+        if self.size() > max_size:
+            raise RuntimeError('Non-splittable item exceeds maximum size.')
+        return [self]
 
     def render_pages(self, max_size):
         return [part.render() for part in self.paginate(max_size)]
@@ -46,6 +46,9 @@ class Line(Paginable):
 
 
 class Compound(Paginable):
+    # Rendered between items.
+    separator = ''
+
     def __init__(self, items=[]):
         self._size = 0
         self._items = []
@@ -58,6 +61,11 @@ class Compound(Paginable):
     def reserved_size(self):
         return 0
 
+    def overhead(self, continued=False):
+        """The size of this item on a page, not counting its items.
+        """
+        return 0
+
     def size(self):
         return self._size + self.reserved_size()
 
@@ -68,29 +76,13 @@ class Compound(Paginable):
         self._size += item.size()
         self._items.append(item)
 
-    def split(self, max_size):
-        if self.size() <= max_size:
-            return self, None
-
-        allowed_size = max_size - self.reserved_size()
-
-        # Splitting sub-items is undesirable, but we sometimes have to
-        # to make progress if the first sub-item is too big.
-        first = self._items[0]
-        if first.size() > allowed_size:
-            first_first, first_rest = first.split(allowed_size)
-            return self.children([first_first], [first_rest] + self._items[1:])
-
-        space_left = allowed_size
-        i = 0
-        while self._items[i].size() <= space_left:
-            space_left -= self._items[i].size()
-            i += 1
-
-        return self.children(self._items[:i], self._items[i:])
+    def paginate(self, max_size):
+        return _Paginator(max_size).run(self)
 
 
 class TextBlock(Compound):
+    separator = '\n'
+
     def __init__(self, items=[], *, prefix='', suffix=''):
         super().__init__(items)
         self._prefix = prefix
@@ -114,6 +106,9 @@ class TextBlock(Compound):
     def reserved_size(self):
         return self._reserved_size
 
+    def overhead(self, continued=False):
+        return len(self._prefix) + len(self._suffix)
+
     def children(self, first, rest):
         opts = dict(prefix=self._prefix, suffix=self._suffix)
         return TextBlock(first, **opts), TextBlock(rest, **opts)
@@ -123,19 +118,177 @@ class HelpSection(TextBlock):
     def __init__(self, items=[], *, name=None, hint=None):
         self._name = name
         self._hint = hint
+        super().__init__(items, prefix=self.make_prefix(name, hint))
 
-        prefix = '**{0._name}**'.format(self) if self._name else ''
-        if self._hint:
-            prefix += self._hint
-        prefix += '\n'
+    @staticmethod
+    def make_prefix(name, hint):
+        prefix = '**{}**'.format(name) if name else ''
+        if hint:
+            prefix += hint
+        return prefix + '\n'
 
-        super().__init__(items, prefix=prefix)
+    def overhead(self, continued=False):
+        if continued:
+            return len(self.make_prefix(self._name, "(cont'd)"))
+        return super().overhead()
 
     def children(self, first, rest):
         return (HelpSection(first, name=self._name, hint=self._hint),
                 HelpSection(rest, name=self._name, hint="(cont'd)"))
 
 
+class _Paginator:
+    """Splits a Compound into pages in a single pass over its items.
+
+    The item tree is walked depth first, keeping a stack of the
+    compounds around the current item along with the items each has
+    collected for the current page. When the page is full, every open
+    compound is closed with `children` and reopened on the next page,
+    so pages keep their prefixes and suffixes and split sections get
+    their "(cont'd)" headers.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.pages = []
+        # [compound, its items on this page, whether an earlier page
+        # already has some of its items]
+        self._open = []
+        self._size = 0
+        self._empty = True
+
+    def run(self, compound):
+        self._open.append([compound, [], False])
+        self._size = compound.overhead()
+        self._walk(compound)
+        if not self._empty or not self.pages:
+            self._finish_page()
+        return self.pages
+
+    def _walk(self, compound):
+        for item in compound.items():
+            if not isinstance(item, Compound):
+                self._add(item)
+                continue
+
+            # Rather start a section on a new page than split it, if
+            # it would fit there.
+            if (not self._empty and self._size + item.size() > self.max_size
+                    and self._fresh_size() + item.size() <= self.max_size):
+                self._new_page()
+
+            self._size += self._slot_size() + item.overhead()
+            self._open.append([item, [], False])
+            self._walk(item)
+            compound, items, continued = self._open.pop()
+            if items:
+                self._open[-1][1].append(self._part(compound, items, continued))
+
+    def _add(self, item):
+        if self._size + self._slot_size() + item.size() > self.max_size and not self._empty:
+            self._new_page()
+        cost = self._slot_size() + item.size()
+        if self._size + cost > self.max_size:
+            raise RuntimeError('Non-splittable item exceeds maximum size.')
+        self._open[-1][1].append(item)
+        self._size += cost
+        self._empty = False
+
+    def _slot_size(self):
+        compound, items, _ = self._open[-1]
+        return len(compound.separator) if items else 0
+
+    def _fresh_size(self):
+        return sum(compound.overhead(continued=True) for compound, _, _ in self._open)
+
+    def _part(self, compound, items, continued):
+        if continued:
+            return compound.children([], items)[1]
+        return compound.children(items, [])[0]
+
+    def _finish_page(self):
+        # Close the open compounds from the innermost out, leaving them
+        # open and empty for the next page.
+        part = None
+        for level in reversed(self._open):
+            compound, items, continued = level
+            if part is not None:
+                items.append(part)
+            part = self._part(compound, items, continued) if items else None
+            level[1:] = [], continued or bool(items)
+        if part is None:
+            part = self._part(*self._open[0])
+        self.pages.append(part)
+
+    def _new_page(self):
+        self._finish_page()
+        self._size = sum(compound.overhead(continued=continued)
+                         for compound, _, continued in self._open)
+        self._empty = True
+
+
+class Pager:
+    """Shows pages one at a time in a single embed, flipped with
+    reactions.
+
+    Pages are only rendered when they're first shown. Both adding and
+    removing a reaction flip the page, so the bot never has to remove
+    anyone's reactions; only the user the pager is for can flip it.
+    It stops responding after `timeout` seconds without a flip.
+    """
+
+    PREVIOUS = '\u25c0'
+    NEXT = '\u25b6'
+
+    def __init__(self, bot, parts, user, timeout=PAGER_TIMEOUT):
+        self.bot = bot
+        self.parts = parts
+        self.user = user
+        self.timeout = timeout
+        self.current = 0
+        self._rendered = {}
+
+    def embed(self, i):
+        text = self._rendered.get(i)
+        if text is None:
+            text = self._rendered[i] = self.parts[i].render()
+        embed = discord.Embed(description=text)
+        embed.set_footer(text='Page {} of {}'.format(i + 1, len(self.parts)))
+        return embed
+
+    async def run(self, destination):
+        message = await destination.send(embed=self.embed(0))
+        try:
+            for emoji in (self.PREVIOUS, self.NEXT):
+                await message.add_reaction(emoji)
+        except discord.HTTPException:
+            return
+
+        def check(reaction, user):
+            return (reaction.message.id == message.id and user == self.user
+                    and reaction.emoji in (self.PREVIOUS, self.NEXT))
+
+        while True:
+            waiting = [asyncio.ensure_future(self.bot.wait_for(event, check=check))
+                       for event in ('reaction_add', 'reaction_remove')]
+            done, pending = await asyncio.wait(
+                waiting, timeout=self.timeout, return_when=asyncio.FIRST_COMPLETED)
+            for future in pending:
+                future.cancel()
+            if not done:
+                break
+
+            reaction, _ = done.pop().result()
+            step = -1 if reaction.emoji == self.PREVIOUS else 1
+            self.current = (self.current + step) % len(self.parts)
+            await message.edit(embed=self.embed(self.current))
+
+        try:
+            await message.clear_reactions()
+        except discord.HTTPException:
+            pass
+
+
 class FancyFormatter(discord.ext.commands.HelpCommand):
     def is_command(self):
         return isinstance(self.context.command, discord.ext.commands.Command)
@@ -179,8 +332,41 @@ class FancyFormatter(discord.ext.commands.HelpCommand):
         return TextBlock.from_text(unwrapped)
 
     async def send_message(self, message):
-        for page in message.render_pages(max_size=2000):
-            await self.get_destination().send(content=page)
+        await self.send_parts(message.paginate(PAGE_SIZE))
+
+    async def send_parts(self, parts):
+        destination = self.get_destination()
+        if len(parts) > 1 and self.can_page(destination):
+            await Pager(self.context.bot, parts, self.context.author).run(destination)
+            return
+        for part in parts:
+            await destination.send(content=part.render())
+
+    def can_page(self, destination):
+        if not isinstance(destination, discord.abc.GuildChannel):
+            return True
+        permissions = destination.permissions_for(self.context.me)
+        return permissions.embed_links and permissions.add_reactions
+
+    def permission_profile(self):
+        channel = self.context.channel
+        author = channel.permissions_for(self.context.author)
+        me = channel.permissions_for(self.context.me)
+        return (tuple(getattr(author, name) for name in PROFILE_PERMISSIONS),
+                tuple(getattr(me, name) for name in PROFILE_PERMISSIONS))
+
+    async def send_cached(self, target, build):
+        """Sends the help for `target`, rendering it with `build` only if
+        it isn't cached for this prefix and permission profile yet.
+        """
+        key = (target, self.clean_prefix, self.context.invoked_with,
+               self.permission_profile())
+        cache = self.context.bot.help_cache
+        parts = cache.get(key)
+        if parts is None:
+            message = await build()
+            parts = cache[key] = message.paginate(PAGE_SIZE)
+        await self.send_parts(parts)
 
     def get_ending_note(self, has_categories=False):
         command_name = self.context.invoked_with
@@ -201,6 +387,9 @@ class FancyFormatter(discord.ext.commands.HelpCommand):
         await self.send_message(message)
 
     async def send_bot_help(self, mapping):
+        await self.send_cached(('bot',), lambda: self.format_bot_help(mapping))
+
+    async def format_bot_help(self, mapping):
         message = TextBlock()
         has_note = False
 
@@ -213,10 +402,13 @@ class FancyFormatter(discord.ext.commands.HelpCommand):
 
         if has_note:
             message.add_line(self.get_ending_note(has_categories=True))
-
-        await self.send_message(message)
+        return message
 
     async def send_cog_help(self, cog):
+        await self.send_cached(('cog', cog.qualified_name),
+                               lambda: self.format_cog_help(cog))
+
+    async def format_cog_help(self, cog):
         message = TextBlock()
 
         description = cog.description
@@ -228,10 +420,13 @@ class FancyFormatter(discord.ext.commands.HelpCommand):
         if commands:
             message.append(self.format_section('Commands', commands))
             message.add_line(self.get_ending_note())
-
-        await self.send_message(message)
+        return message
 
     async def send_group_help(self, group):
+        await self.send_cached(('command', group.qualified_name),
+                               lambda: self.format_group_help(group))
+
+    async def format_group_help(self, group):
         message = TextBlock()
 
         description = group.description
@@ -248,10 +443,13 @@ class FancyFormatter(discord.ext.commands.HelpCommand):
         subcommands = await self.filter_commands(group.commands, sort=True)
         if subcommands:
             message.append(self.format_section('Subcommands', subcommands))
-
-        await self.send_message(message)
+        return message
 
     async def send_command_help(self, command):
+        await self.send_cached(('command', command.qualified_name),
+                               lambda: self.format_command_help(command))
+
+    async def format_command_help(self, command):
         message = TextBlock()
 
         description = command.description
@@ -264,5 +462,4 @@ class FancyFormatter(discord.ext.commands.HelpCommand):
         if command.help:
             message.append(self.format_description(command.help))
             message.add_line()
-
-        await self.send_message(message)
+        return message
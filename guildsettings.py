@@ -0,0 +1,261 @@
+import collections
+import json
+import re
+
+from discord.ext import commands
+
+import formatter
+import utils
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS guild_settings (
+    guild_id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (guild_id, name)
+);
+'''
+
+
+def parse_text(text):
+    # Quotes allow leading or trailing spaces, or an empty value.
+    if len(text) >= 2 and text[0] == text[-1] == '"':
+        return text[1:-1]
+    return text
+
+
+def parse_prefix(text):
+    text = parse_text(text)
+    if not text.strip():
+        raise ValueError("The prefix can't be empty.")
+    return text
+
+
+def parse_list(text):
+    return [item.strip() for item in text.split(',') if item.strip()]
+
+
+def parse_fraction(text):
+    try:
+        value = float(text)
+    except ValueError:
+        raise ValueError('"{}" isn\'t a number.'.format(text))
+    if not 0 <= value <= 1:
+        raise ValueError('That should be between 0 and 1.')
+    return value
+
+
+def parse_flag(text):
+    text = text.lower()
+    if text in ('yes', 'on', 'true'):
+        return True
+    if text in ('no', 'off', 'false'):
+        return False
+    raise ValueError('Say "yes" or "no".')
+
+
+def parse_regex(text):
+    text = parse_text(text)
+    try:
+        re.compile(text)
+    except re.error as error:
+        raise ValueError("That's not a valid regex: {}.".format(error))
+    return text
+
+
+def show_list(value):
+    return ', '.join(value) or '(none)'
+
+
+class Setting:
+    """A per-guild setting: how to parse and show its values, and its
+    default, which comes from the settings file.
+    """
+
+    def __init__(self, name, default, description, parse=parse_text, show=repr):
+        self.name = name
+        self.default = default
+        self.description = description
+        self.parse = parse
+        self.show = show
+
+
+SETTINGS = collections.OrderedDict((setting.name, setting) for setting in [
+    Setting('prefix', utils.setting('BOT_COMMAND_PREFIX', '?'),
+            "What commands start with.", parse_prefix),
+    Setting('channel_whitelist', utils.setting('BOT_CHANNEL_WHITELIST', []),
+            "Channels the bot only works in, if any.", parse_list, show_list),
+    Setting('channel_blacklist', utils.setting('BOT_CHANNEL_BLACKLIST', []),
+            "Channels the bot doesn't work in.", parse_list, show_list),
+    Setting('channel_regex', utils.setting('BOT_CHANNEL_REGEX', r'^bots?($|[-_].*)'),
+            "Regex for the names of channels the bot works in.", parse_regex),
+    Setting('role_whitelist', utils.setting('BOT_ROLE_WHITELIST', []),
+            "Roles needed to use the bot, if any.", parse_list, show_list),
+    Setting('role_blacklist', utils.setting('BOT_ROLE_BLACKLIST', []),
+            "Roles that can't use the bot.", parse_list, show_list),
+    Setting('superuser_roles', utils.setting('BOT_SUPERUSER_ROLES', []),
+            "Roles that can use the bot anywhere.", parse_list, show_list),
+    Setting('opt_role_prefix', utils.setting('OPT_ROLE_PREFIX', 'In:'),
+            "Prefix of opt-in role names.", parse_prefix),
+    Setting('auto_role_prefix', utils.setting('AUTO_ROLE_PREFIX', '(Auto)'),
+            "Prefix of auto role names.", parse_prefix),
+    Setting('color_role_prefix', utils.setting('COLORS_ROLE_PREFIX', ''),
+            "Prefix of color role names."),
+    Setting('colors_min_luminance', utils.setting('COLORS_MIN_LUMINANCE', 0.15),
+            "How dark colors can be, from 0 to 1.", parse_fraction),
+    Setting('colors_max_luminance', utils.setting('COLORS_MAX_LUMINANCE', 0.75),
+            "How light colors can be, from 0 to 1.", parse_fraction),
+    Setting('colors_limit_palette', utils.setting('COLORS_LIMIT_PALETTE', False),
+            "Whether colors are rounded to a small palette.", parse_flag),
+])
+
+
+class GuildSettings(commands.Cog, name='Settings'):
+    """Per-guild settings, editable with the `config` command.
+
+    Values are stored in the bot's database and all loaded into memory
+    when the bot starts, so reading one never waits. Each change bumps
+    the guild's version, which throws away anything computed from the
+    old values with `derived`, and is announced to the callbacks
+    registered with `subscribe` right away.
+    """
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.bot.storage.declare(SCHEMA)
+        # guild ID -> name -> value, for values that aren't the default
+        self._values = collections.defaultdict(dict)
+        # guild ID -> number of changes made to its settings
+        self._versions = collections.Counter()
+        # (guild ID, key) -> (version, value computed from settings)
+        self._derived = {}
+        self._subscribers = []
+        self._loaded = False
+
+    def get(self, guild, name):
+        values = self._values.get(guild.id) if guild else None
+        if values and name in values:
+            return values[name]
+        return SETTINGS[name].default
+
+    def derived(self, guild, key, compute):
+        version = self._versions[guild.id]
+        entry = self._derived.get((guild.id, key))
+        if entry is None or entry[0] != version:
+            entry = self._derived[(guild.id, key)] = (version, compute())
+        return entry[1]
+
+    def subscribe(self, callback):
+        """Registers `callback(guild, names)` to be called whenever
+        settings of a guild change.
+        """
+        self._subscribers.append(callback)
+
+    def _changed(self, guild_id, names):
+        self._versions[guild_id] += 1
+        guild = self.bot.get_guild(guild_id)
+        if guild is not None:
+            for callback in self._subscribers:
+                callback(guild, names)
+
+    async def set(self, guild, name, value):
+        await self.bot.storage.execute(
+            'INSERT OR REPLACE INTO guild_settings (guild_id, name, value) VALUES (?, ?, ?)',
+            (guild.id, name, json.dumps(value)))
+        self._values[guild.id][name] = value
+        self._changed(guild.id, {name})
+
+    async def reset(self, guild, name):
+        await self.bot.storage.execute(
+            'DELETE FROM guild_settings WHERE guild_id = ? AND name = ?', (guild.id, name))
+        self._values[guild.id].pop(name, None)
+        self._changed(guild.id, {name})
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        rows = await self.bot.storage.fetchall(
+            'SELECT guild_id, name, value FROM guild_settings')
+        for guild_id, name, value in rows:
+            if name in SETTINGS:
+                self._values[guild_id][name] = json.loads(value)
+        for guild_id, values in list(self._values.items()):
+            self._changed(guild_id, set(values))
+
+    @commands.group(invoke_without_command=True)
+    @commands.has_permissions(administrator=True)
+    async def config(self, ctx):
+        """Shows this guild's settings. (admin only)
+        """
+        block = formatter.TextBlock()
+        for setting in SETTINGS.values():
+            value = self.get(ctx.guild, setting.name)
+            block.add_line('`{}` = `{}`{}\n {}'.format(
+                setting.name, setting.show(value),
+                '' if value == setting.default else ' (changed)',
+                setting.description))
+        block.add_line()
+        block.add_line("Change these with `config set <name> <value>`, or go back "
+                       "to the default with `config reset <name>`. Lists are "
+                       "separated with commas.")
+        for page in block.render_pages(max_size=2000):
+            await ctx.send(page)
+
+    @config.command(name='set')
+    @commands.has_permissions(administrator=True)
+    async def config_set(self, ctx, name: str, *, value: str):
+        """Changes one of this guild's settings. (admin only)
+        """
+        setting = await self.find_setting(ctx, name)
+        if setting is None:
+            return
+        try:
+            parsed = setting.parse(value.strip())
+            self.check_luminance_range(ctx.guild, setting.name, parsed)
+        except ValueError as error:
+            await ctx.reply(str(error))
+            return
+        await self.set(ctx.guild, setting.name, parsed)
+        await ctx.reply("`{}` is now `{}`.".format(setting.name, setting.show(parsed)))
+
+    @config.command(name='reset')
+    @commands.has_permissions(administrator=True)
+    async def config_reset(self, ctx, name: str):
+        """Puts one of this guild's settings back to the default. (admin only)
+        """
+        setting = await self.find_setting(ctx, name)
+        if setting is None:
+            return
+        try:
+            self.check_luminance_range(ctx.guild, setting.name, setting.default)
+        except ValueError as error:
+            await ctx.reply(str(error))
+            return
+        await self.reset(ctx.guild, setting.name)
+        await ctx.reply("`{}` is back to `{}`.".format(
+            setting.name, setting.show(setting.default)))
+
+    def check_luminance_range(self, guild, name, value):
+        # The luminance limits are set one at a time, but only make
+        # sense together.
+        low = self.get(guild, 'colors_min_luminance')
+        high = self.get(guild, 'colors_max_luminance')
+        if name == 'colors_min_luminance':
+            low = value
+        elif name == 'colors_max_luminance':
+            high = value
+        else:
+            return
+        if low > high:
+            raise ValueError("The minimum luminance can't be above the maximum "
+                             "({} > {}).".format(low, high))
+
+    async def find_setting(self, ctx, name):
+        setting = SETTINGS.get(name.lower())
+        if setting is None:
+            await ctx.reply("There's no setting called `{}`. Try {}.".format(
+                name, utils.pretty_list(['`{}`'.format(name) for name in SETTINGS],
+                                        bold=False, conjunction='or')))
+        return setting
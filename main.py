@@ -1,6 +1,5 @@
 import collections
 import logging
-import re
 import sys
 import traceback
 
@@ -12,18 +11,18 @@ import autoroles
 import colors
 import config
 import formatter
+import guildsettings
 import optroles
+import policy
+import preflight
+import progress
+import reconciler
+import roleindex
+import stickyroles
+import storage
 import utils
 
 
-CHANNEL_WHITELIST = utils.setting('BOT_CHANNEL_WHITELIST', [])
-CHANNEL_BLACKLIST = utils.setting('BOT_CHANNEL_BLACKLIST', [])
-CHANNEL_REGEX = utils.setting('BOT_CHANNEL_REGEX', r'^bots?($|[-_].*)')
-ROLE_WHITELIST = [r.lower() for r in utils.setting('BOT_ROLE_WHITELIST', [])]
-ROLE_BLACKLIST = [r.lower() for r in utils.setting('BOT_ROLE_BLACKLIST', [])]
-SUPERUSER_ROLES = [r.lower() for r in utils.setting('BOT_SUPERUSER_ROLES', [])]
-
-
 async def adminhelp(ctx, *, category: str = None):
     """Gives admin-relevant details about this bot.
     """
@@ -45,48 +44,61 @@ async def adminhelp(ctx, *, category: str = None):
         await ctx.send(cog.adminhelp(ctx))
 
 
+@commands.is_owner()
+async def messagestats(ctx):
+    """Shows how many messages the bot has looked at since it started.
+    """
+    stats = ctx.bot.message_stats
+    reasons = [('prefix', 'had no command prefix'), ('bot', 'were from bots'),
+               ('dm', 'were direct messages')]
+    ignored = ['{} {}'.format(stats[reason], description)
+               for reason, description in reasons if stats[reason]]
+    message = "Looked at {} messages, and passed {} on to commands.".format(
+        sum(stats.values()), stats['passed'])
+    if ignored:
+        message += " Of the ones ignored, {}.".format(utils.pretty_list(ignored, bold=False))
+    await ctx.reply(message)
+
+
+def guild_prefix(bot, message):
+    return bot.settings.get(message.guild, 'prefix')
+
+
 class Irisbot(utils.Bot):
     def __init__(self):
-        super().__init__(command_prefix='?',
+        super().__init__(command_prefix=guild_prefix,
                          description='Self-service role and color assignment.',
-                         help_command=formatter.FancyFormatter())
+                         help_command=formatter.FancyFormatter(),
+                         allow_dms=False)
         self._help_text = 'say ?help in #bot-'
+        self.storage = storage.Storage()
+        self.reconciler = reconciler.RoleReconciler(self)
+        self.jobs = progress.Jobs(self.loop)
+        self.settings = guildsettings.GuildSettings(self)
 
         # This is scary but it seems to be needed to get a cog-less command.
         self.command(name="adminhelp")(adminhelp)
+        self.command(name="messagestats", hidden=True)(messagestats)
 
         self.add_check(self.is_allowed)
+        self.role_views = roleindex.RoleViews()
+        self.add_cog(self.role_views)
+        self.add_cog(self.settings)
+        self.policy = policy.AccessPolicy(self)
+        self.add_cog(self.policy)
+        self.preflight = preflight.Preflight(self)
+        self.add_cog(self.preflight)
         self.add_cog(admintools.AdminTools(self))
         self.add_cog(autoroles.AutoRoles(self))
         self.add_cog(colors.Colors(self))
         self.add_cog(optroles.OptRoles(self))
+        self.add_cog(stickyroles.StickyRoles(self))
 
-    def check_superuser(self, ctx):
-        return any(r.name.lower() in SUPERUSER_ROLES
-                   for r in ctx.message.author.roles)
-
-    def check_channel(self, ctx):
-        name = ctx.message.channel.name
-        if CHANNEL_WHITELIST:
-            return name in CHANNEL_WHITELIST
-        if name in CHANNEL_BLACKLIST:
-            return False
-        if CHANNEL_REGEX:
-            return re.match(CHANNEL_REGEX, name)
-        return True
-
-    def check_roles(self, ctx):
-        names = [role.name.lower() for role in ctx.message.author.roles]
-        if ROLE_WHITELIST:
-            return any(name in ROLE_WHITELIST for name in names)
-        if ROLE_BLACKLIST:
-            return not any(name in ROLE_BLACKLIST for name in names)
-        return True
+    def quick_prefixes(self, message):
+        return (guild_prefix(self, message),)
 
     def is_allowed(self, ctx):
-        if self.check_superuser(ctx):
-            return True
-        return self.check_channel(ctx) and self.check_roles(ctx)
+        return self.policy.allows(ctx)
 
     def oauth2_url(self):
         wanted_permissions = discord.Permissions.none()
@@ -114,6 +126,9 @@ class Irisbot(utils.Bot):
     async def on_command_error(self, context, exception):
         if isinstance(exception, commands.CheckFailure):
             return
+        if isinstance(exception, preflight.PreflightError):
+            await context.reply(str(exception))
+            return
 
         print('Ignoring exception in command {}'.format(
             context.command), file=sys.stderr)
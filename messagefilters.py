@@ -0,0 +1,124 @@
+import datetime
+import re
+
+import discord
+
+import utils
+
+# name:value or name:"value with spaces", or a bare word.
+_token_re = re.compile(r'(\w+):(?:"([^"]*)"|(\S*))|(\S+)')
+_user_re = re.compile(r'<@!?(\d+)>|(\d+)')
+_date_re = re.compile(r'(\d{4})-(\d{1,2})-(\d{1,2})')
+_link_re = re.compile(r'https?://\S', re.I)
+
+_has_checks = {
+    'attachment': lambda message: message.attachments,
+    'embed': lambda message: message.embeds,
+    'link': lambda message: _link_re.search(message.content),
+}
+
+
+class FilterError(ValueError):
+    """Raised for a filter that can't be understood. The message is
+    meant to be shown to the user.
+    """
+
+
+class MessageFilter:
+    """Selects messages by author, content, date and attachments.
+
+    Filters are parsed and compiled once, then applied to messages as
+    they stream in. `before` and `after` are also exposed so a history
+    scan can start and stop at the right place instead of checking
+    every message.
+    """
+
+    def __init__(self):
+        self.before = None
+        self.after = None
+        self._checks = []
+
+    def __bool__(self):
+        return bool(self._checks) or self.before is not None or self.after is not None
+
+    def __call__(self, message):
+        return all(check(message) for check in self._checks)
+
+    def add_authors(self, ids):
+        self._checks.append(lambda message: message.author.id in ids)
+
+    def add_pattern(self, pattern):
+        self._checks.append(lambda message: pattern.search(message.content))
+
+    def add_check(self, check):
+        self._checks.append(check)
+
+
+def parse_time(value):
+    """Parses a date (2020-01-31), a message ID or a duration ago (3d)
+    into a naive UTC datetime.
+    """
+    m = _date_re.fullmatch(value)
+    if m:
+        try:
+            return datetime.datetime(*map(int, m.groups()))
+        except ValueError:
+            pass
+    elif value.isdigit() and len(value) >= 15:
+        return discord.utils.snowflake_time(int(value))
+    else:
+        seconds = utils.parse_duration(value)
+        if seconds is not None:
+            return datetime.datetime.utcnow() - datetime.timedelta(seconds=seconds)
+    raise FilterError('"{}" isn\'t a date, message ID or duration.'.format(value))
+
+
+def parse_user(guild, value):
+    m = _user_re.fullmatch(value)
+    if m:
+        return int(m.group(1) or m.group(2))
+    member = guild.get_member_named(value)
+    if member is None:
+        raise FilterError('I can\'t find a user called "{}".'.format(value))
+    return member.id
+
+
+def parse(guild, text):
+    """Parses filters like `from:@user matching:"some regex" has:link`.
+
+    Returns the compiled MessageFilter, and the words that weren't
+    filters for the caller to interpret.
+    """
+    result = MessageFilter()
+    authors = set()
+    rest = []
+    for m in _token_re.finditer(text):
+        name, quoted, value, word = m.groups()
+        if word is not None:
+            rest.append(word)
+            continue
+        name = name.lower()
+        value = quoted if quoted is not None else value
+        if name == 'from':
+            authors.add(parse_user(guild, value))
+        elif name == 'matching':
+            try:
+                result.add_pattern(re.compile(value, re.I))
+            except re.error as error:
+                raise FilterError("That's not a valid regex: {}.".format(error))
+        elif name == 'before':
+            result.before = parse_time(value)
+        elif name == 'after':
+            result.after = parse_time(value)
+        elif name == 'has':
+            check = _has_checks.get(value.lower())
+            if check is None:
+                raise FilterError('Try {} instead.'.format(utils.pretty_list(
+                    ['`has:{}`'.format(name) for name in _has_checks],
+                    bold=False, conjunction='or')))
+            result.add_check(check)
+        else:
+            raise FilterError('I don\'t know the "{}:" filter.'.format(name))
+    if authors:
+        result.add_authors(authors)
+    return result, rest
@@ -1,28 +1,43 @@
+import collections
+import re
+
 import discord
 from discord.ext import commands
 
+import expirations
 from rolecog import RoleCog
+import rolematch
 import utils
 
-ROLE_PREFIX = utils.setting('OPT_ROLE_PREFIX', 'In:').lower()
+DURATION_REGEX = re.compile(r'(.*) +for +([^ ].*)', re.I)
 
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS optrole_expiry (
+    guild_id INTEGER NOT NULL,
+    role_id INTEGER PRIMARY KEY,
+    seconds REAL NOT NULL
+);
+'''
 
-def pretty_role(role):
-    name = role.name.lower()
-    if name.startswith(ROLE_PREFIX):
-        return name[len(ROLE_PREFIX):]
-    else:
-        return name
 
+def split_duration(text):
+    """Splits a trailing "for <duration>" off a list of roles.
 
-def pretty_role_list(roles, **kwargs):
-    return utils.pretty_list([pretty_role(r) for r in roles], **kwargs)
+    Returns the rest of the text and the duration in seconds, or None
+    if there's no duration.
+    """
+    m = DURATION_REGEX.fullmatch(text.strip())
+    if m:
+        seconds = utils.parse_duration(m.group(2))
+        if seconds:
+            return m.group(1), seconds
+    return text, None
 
 
-def partition_roles(roles, member):
+def partition_roles(roles, member_roles):
     absent, present = [], []
     for r in roles:
-        if r in member.roles:
+        if member_roles.has(r):
             present.append(r)
         else:
             absent.append(r)
@@ -33,31 +48,92 @@ class OptRoles(RoleCog, name="Roles"):
     """Commands to allow users to assign themselves roles.
     """
 
+    sticky = True
+    role_settings = ('opt_role_prefix',)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # guild -> RoleTrie of role keys
+        self._tries = {}
+        # role ID -> seconds the role lasts for by default
+        self._default_expiry = {}
+        self.expirations = expirations.RoleExpirations(self.bot)
+        self.bot.storage.declare(SCHEMA)
+
+    def trie_for(self, guild):
+        trie = self._tries.get(guild)
+        if trie is None:
+            trie = self._tries[guild] = rolematch.RoleTrie()
+        return trie
+
+    def _sync_role(self, role):
+        super()._sync_role(role)
+        key = self.key_for_role(role)
+        if key:
+            self.trie_for(role.guild).add(key)
+
+    def _remove_role(self, role):
+        super()._remove_role(role)
+        key = self.key_for_role(role)
+        if key and not self.get_roles(role.guild, key):
+            self.trie_for(role.guild).remove(key)
+
+    def _forget_guild(self, guild):
+        super()._forget_guild(guild)
+        self._tries.pop(guild, None)
+
+    @commands.Cog.listener('on_ready')
+    async def start_expirations(self):
+        rows = await self.bot.storage.fetchall(
+            'SELECT role_id, seconds FROM optrole_expiry')
+        self._default_expiry = dict(rows)
+        await self.expirations.start()
+
     def adminhelp(self, ctx):
+        guild = ctx.message.guild
+        return self.cached(guild, 'adminhelp', lambda: self._adminhelp(guild))
+
+    def _adminhelp(self, guild):
         desc = ("This module lets users assign and remove certain roles from "
                 "themselves. Only roles starting with the prefix `{}` can be "
-                "assigned this way.").format(ROLE_PREFIX)
+                "assigned this way.").format(self.role_prefix(guild))
+        desc += "\n\n"
+        desc += ("Users can join roles temporarily with `join <roles> for <duration>`, "
+                 "and you can make roles wear off by default with the `expiry` "
+                 "command.")
         desc += "\n\n"
         desc += "Currently recognized opt-in roles: {}.".format(
             ', '.join('`{}`'.format(role.name)
-                      for role in self.all_roles(ctx.message.guild))
+                      for role in self.all_roles(guild))
         )
         return desc
 
+    def role_prefix(self, guild):
+        return self.bot.settings.get(guild, 'opt_role_prefix').lower()
+
     def key_for_role(self, role):
         name = role.name.lower()
-        if name.startswith(ROLE_PREFIX):
-            return name[len(ROLE_PREFIX):]
+        prefix = self.role_prefix(role.guild)
+        if name.startswith(prefix):
+            return name[len(prefix):]
+
+    def pretty_role(self, role):
+        return self.key_for_role(role) or role.name.lower()
+
+    def pretty_role_list(self, roles, **kwargs):
+        return utils.pretty_list([self.pretty_role(r) for r in roles], **kwargs)
 
     @commands.command()
     async def roles(self, ctx):
         """Lists available opt-in roles.
         """
-        author = ctx.author
         guild = ctx.guild
-        absent, present = partition_roles(self.all_roles(guild), author)
-        available = pretty_role_list(absent)
-        posessed = pretty_role_list(present)
+        mask = self.bot.role_views.view(ctx.author).mask
+        absent, present = [], []
+        for bit, name in self.cached(guild, 'listing', lambda: self._listing(guild)):
+            (present if mask & bit else absent).append(name)
+        available = utils.pretty_list(absent, bold=False)
+        posessed = utils.pretty_list(present, bold=False)
 
         if available and posessed:
             message = "Available roles are {}. (You're currently in {}).".format(
@@ -71,28 +147,40 @@ class OptRoles(RoleCog, name="Roles"):
             message = "There are no user-joinable roles at this time."
         await ctx.reply(message)
 
+    def _listing(self, guild):
+        # The opt-in roles of a guild as (role ID bit, rendered name)
+        # pairs, sorted by name.
+        index = self.bot.role_views.for_guild(guild)
+        names = sorted(((self.pretty_role(role), role) for role in self.all_roles(guild)),
+                       key=lambda pair: pair[0])
+        return [(index.bit(str(role.id)), '**{}**'.format(name))
+                for name, role in names]
+
     @commands.group(invoke_without_command=True)
-    async def join(self, ctx, *roles):
+    async def join(self, ctx, *, roles: str = ''):
         """Adds roles to the user.
+
+        End the list of roles with "for" and a duration (like "for 2h"
+        or "for 1d 12h") to leave them again automatically.
         """
-        roles = [r[:-1] if r.endswith(',') else r for r in roles]
+        roles, duration = split_duration(roles)
         found, not_found = self.parse_role_list(ctx.message.guild, roles)
         if not_found:
             await self.say_no_such_roles(ctx, not_found)
         else:
-            await self.join_roles(ctx, found)
+            await self.join_roles(ctx, found, duration)
 
     @join.command(name='all')
     async def join_all(self, ctx):
         """Adds all opt-in roles to the user."""
-        roles = self.all_roles(ctx.message.guild)
+        roles = list(self.all_roles(ctx.message.guild))
         if roles:
             await self.join_roles(ctx, roles)
         else:
             await ctx.reply("There are no user-joinable roles at this time.")
 
     @commands.group(invoke_without_command=True)
-    async def leave(self, ctx, *roles):
+    async def leave(self, ctx, *, roles: str = ''):
         """Removes roles from the user.
         """
         found, not_found = self.parse_role_list(ctx.message.guild, roles)
@@ -104,51 +192,126 @@ class OptRoles(RoleCog, name="Roles"):
     @leave.command(name='all')
     async def leave_all(self, ctx):
         """Removes all opt-in roles from the user."""
-        roles = self.all_roles(ctx.message.guild)
+        roles = list(self.all_roles(ctx.message.guild))
         if roles:
             await self.leave_roles(ctx, roles)
         else:
             await ctx.reply("There are no user-joinable roles at this time.")
 
     async def say_no_such_roles(self, ctx, names):
-        message = "Sorry, there isn't any role named {}."
-        await ctx.reply(message.format(utils.pretty_list(names, conjunction='or')))
-
-    def parse_role_list(self, guild, role_names):
-        found = []
-        not_found = []
-        for name in role_names:
-            role = self.get_role(guild, name.lower())
-            if role:
-                found.append(role)
-            else:
-                not_found.append(name)
+        message = "Sorry, there isn't any role named {}.".format(
+            utils.pretty_list(names, conjunction='or'))
+        trie = self.trie_for(ctx.message.guild)
+        suggestions = list(filter(None, map(trie.suggest, names)))
+        if suggestions:
+            message += " Did you mean {}?".format(self.pretty_role_list(
+                [self.get_role(ctx.message.guild, key) for key in suggestions],
+                conjunction='or'))
+        await ctx.reply(message)
+
+    def parse_role_list(self, guild, text):
+        """Finds the roles named in a text, longest names first.
+
+        Returns the roles found and the phrases that didn't match any
+        role.
+        """
+        keys, not_found = self.trie_for(guild).parse(text)
+        found = [self.get_role(guild, key) for key in keys]
         return found, not_found
 
-    async def join_roles(self, ctx, roles):
+    async def join_roles(self, ctx, roles, duration=None):
+        roles = list(roles)
         user = ctx.message.author
-        absent, present = partition_roles(roles, user)
+        absent, present = partition_roles(roles, self.bot.role_views.view(user))
+
+        # seconds -> roles expiring after that long
+        expiring = collections.defaultdict(list)
+        for role in (roles if duration else absent):
+            seconds = duration or self._default_expiry.get(role.id)
+            if seconds:
+                expiring[seconds].append(role)
+        if not duration:
+            # Joining a role again without a duration keeps it, unless
+            # it wears off by default.
+            await self.expirations.cancel(user, [
+                role for role in roles if not self._default_expiry.get(role.id)])
+
         if absent:
-            await user.add_roles(*absent)
-            added_list = pretty_role_list(absent)
-            already_list = pretty_role_list(present)
+            await self.bot.reconciler.update(user, lambda roles: roles | set(absent))
+            added_list = self.pretty_role_list(absent)
+            already_list = self.pretty_role_list(present)
             message = "Added you to role {}."
             if present:
                 message += " (You're already in {}.)"
-            await ctx.reply(message.format(added_list, already_list))
+            message = message.format(added_list, already_list)
         else:
-            await ctx.reply("You're already in all of those roles.")
+            message = "You're already in all of those roles."
+
+        for seconds, group in expiring.items():
+            await self.expirations.schedule(user, group, seconds)
+            message += " You'll leave {} in {}.".format(
+                self.pretty_role_list(group), utils.pretty_duration(seconds))
+        await ctx.reply(message)
 
     async def leave_roles(self, ctx, roles):
+        roles = list(roles)
         user = ctx.message.author
-        absent, present = partition_roles(roles, user)
+        absent, present = partition_roles(roles, self.bot.role_views.view(user))
+        await self.expirations.cancel(user, roles)
         if present:
-            await user.remove_roles(*present)
-            removed_list = pretty_role_list(present)
-            not_in_list = pretty_role_list(absent, conjunction='or')
+            await self.bot.reconciler.update(user, lambda roles: roles - set(present))
+            removed_list = self.pretty_role_list(present)
+            not_in_list = self.pretty_role_list(absent, conjunction='or')
             message = "Removed you from role {}."
             if absent:
                 message += " (You weren't in {} in the first place.)"
             await ctx.reply(message.format(removed_list, not_in_list))
         else:
             await ctx.reply("You aren't in any of those roles.")
+
+    @commands.command()
+    @commands.has_permissions(manage_roles=True)
+    async def expiry(self, ctx, *, text: str):
+        """Sets how long opt-in roles last. (admin only)
+
+        "expiry lfg for 2h" makes the lfg role wear off two hours after
+        someone joins it, and "expiry lfg for never" makes it last
+        until they leave it again.
+        """
+        m = DURATION_REGEX.fullmatch(text.strip())
+        if not m:
+            await ctx.reply('Try something like "expiry lfg for 2h".')
+            return
+
+        names, when = m.groups()
+        if when.lower() in ('never', 'ever', 'good'):
+            seconds = None
+        else:
+            seconds = utils.parse_duration(when)
+            if not seconds:
+                await ctx.reply("Sorry, I don't know how long {} is.".format(when))
+                return
+
+        found, not_found = self.parse_role_list(ctx.message.guild, names)
+        if not_found:
+            await self.say_no_such_roles(ctx, not_found)
+            return
+
+        guild_id = ctx.message.guild.id
+        if seconds is None:
+            await self.bot.storage.executemany(
+                'DELETE FROM optrole_expiry WHERE role_id = ?',
+                [(role.id,) for role in found])
+            for role in found:
+                self._default_expiry.pop(role.id, None)
+            message = "{} will no longer wear off."
+        else:
+            await self.bot.storage.executemany(
+                'INSERT OR REPLACE INTO optrole_expiry (guild_id, role_id, seconds) '
+                'VALUES (?, ?, ?)',
+                [(guild_id, role.id, seconds) for role in found])
+            for role in found:
+                self._default_expiry[role.id] = seconds
+            message = "{{}} will now wear off {} after being joined.".format(
+                utils.pretty_duration(seconds))
+        await ctx.reply(message.format(self.pretty_role_list(found)))
@@ -0,0 +1,108 @@
+import collections
+import re
+
+from discord.ext import commands
+
+
+class GuildRoles:
+    """The role names in a guild's access settings, resolved to the IDs
+    of its roles. The white list is None if there isn't one.
+    """
+
+    def __init__(self, guild, settings):
+        def ids(setting):
+            names = set(name.lower() for name in settings.get(guild, setting))
+            return frozenset(role.id for role in guild.roles if role.name.lower() in names)
+        self.superusers = ids('superuser_roles')
+        self.whitelist = ids('role_whitelist') if settings.get(guild, 'role_whitelist') else None
+        self.blacklist = ids('role_blacklist')
+
+
+class AccessPolicy(commands.Cog):
+    """Decides who may use the bot's commands, and where.
+
+    Whether a channel is allowed is worked out once per channel, and
+    the role names in the settings once per guild, so checking a
+    command is a few set lookups. Both are worked out again when the
+    guild's settings change.
+    """
+
+    def __init__(self, bot):
+        self.bot = bot
+        # guild ID -> channel ID -> whether commands may be used there
+        self._channels = collections.defaultdict(dict)
+        # guild ID -> GuildRoles
+        self._roles = {}
+        bot.settings.subscribe(self.settings_changed)
+
+    def roles_for(self, guild):
+        roles = self._roles.get(guild.id)
+        if roles is None:
+            roles = self._roles[guild.id] = GuildRoles(guild, self.bot.settings)
+        return roles
+
+    def channel_allowed(self, channel):
+        channels = self._channels[channel.guild.id]
+        allowed = channels.get(channel.id)
+        if allowed is None:
+            allowed = channels[channel.id] = self._check_channel(channel)
+        return allowed
+
+    def _check_channel(self, channel):
+        settings = self.bot.settings
+        guild, name = channel.guild, channel.name
+        whitelist = settings.get(guild, 'channel_whitelist')
+        if whitelist:
+            return name in whitelist
+        if name in settings.get(guild, 'channel_blacklist'):
+            return False
+        pattern = settings.get(guild, 'channel_regex')
+        if pattern:
+            regex = settings.derived(guild, 'channel_regex', lambda: re.compile(pattern))
+            return bool(regex.match(name))
+        return True
+
+    def allows(self, ctx):
+        if ctx.guild is None:
+            return False
+        roles = self.roles_for(ctx.guild)
+        ids = self.bot.role_views.view(ctx.author).ids
+        if not ids.isdisjoint(roles.superusers):
+            return True
+        if not self.channel_allowed(ctx.channel):
+            return False
+        if roles.whitelist is not None:
+            return not ids.isdisjoint(roles.whitelist)
+        return ids.isdisjoint(roles.blacklist)
+
+    def settings_changed(self, guild, names):
+        self._forget_guild(guild)
+
+    def _forget_guild(self, guild):
+        self._roles.pop(guild.id, None)
+        self._channels.pop(guild.id, None)
+
+    @commands.Cog.listener()
+    async def on_guild_channel_update(self, before, after):
+        self._channels[after.guild.id].pop(after.id, None)
+
+    @commands.Cog.listener()
+    async def on_guild_channel_delete(self, channel):
+        self._channels[channel.guild.id].pop(channel.id, None)
+
+    @commands.Cog.listener()
+    async def on_guild_role_create(self, role):
+        self._roles.pop(role.guild.id, None)
+
+    @commands.Cog.listener()
+    async def on_guild_role_update(self, before, after):
+        if before.name != after.name:
+            self._roles.pop(after.guild.id, None)
+
+    @commands.Cog.listener()
+    async def on_guild_role_delete(self, role):
+        self._roles.pop(role.guild.id, None)
+
+    @commands.Cog.listener()
+    async def on_guild_remove(self, guild):
+        self._forget_guild(guild)
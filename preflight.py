@@ -0,0 +1,79 @@
+from discord.ext import commands
+
+import utils
+
+
+class PreflightError(commands.CommandError):
+    """Raised instead of making a request Discord would refuse anyway.
+    """
+
+
+class Preflight(commands.Cog):
+    """Checks locally whether the bot is able to change roles.
+
+    The bot's highest role position and its permissions are cached
+    per guild and refreshed whenever roles or the bot's own member
+    change, so checks don't cost anything.
+    """
+
+    def __init__(self, bot):
+        self.bot = bot
+        # guild ID -> (position of the bot's top role, bot's permissions)
+        self._cache = {}
+
+    def _state(self, guild):
+        state = self._cache.get(guild.id)
+        if state is None:
+            me = guild.me
+            state = self._cache[guild.id] = (me.top_role.position, me.guild_permissions)
+        return state
+
+    def check_manage_roles(self, guild):
+        _, permissions = self._state(guild)
+        if not permissions.manage_roles:
+            raise PreflightError("I need the Manage Roles permission to do that.")
+
+    def check_roles(self, guild, roles):
+        """Raises PreflightError unless the bot can give and take away
+        all of the given roles.
+        """
+        if not roles:
+            return
+        self.check_manage_roles(guild)
+        out_of_reach = self.out_of_reach(guild, roles)
+        if out_of_reach:
+            message = "I can't hand out {} since my own roles aren't high enough."
+            raise PreflightError(message.format(utils.pretty_list(
+                [role.name for role in out_of_reach], conjunction='or')))
+
+    def out_of_reach(self, guild, roles):
+        """The roles the bot can't give or take away, which is all of
+        them without the Manage Roles permission.
+        """
+        if not roles:
+            return []
+        top_position, permissions = self._state(guild)
+        if not permissions.manage_roles:
+            return list(roles)
+        return [role for role in roles if role.managed or role.position >= top_position]
+
+    @commands.Cog.listener()
+    async def on_guild_role_create(self, role):
+        self._cache.pop(role.guild.id, None)
+
+    @commands.Cog.listener()
+    async def on_guild_role_update(self, old, new):
+        self._cache.pop(new.guild.id, None)
+
+    @commands.Cog.listener()
+    async def on_guild_role_delete(self, role):
+        self._cache.pop(role.guild.id, None)
+
+    @commands.Cog.listener()
+    async def on_member_update(self, before, after):
+        if after.id == self.bot.user.id:
+            self._cache.pop(after.guild.id, None)
+
+    @commands.Cog.listener()
+    async def on_guild_remove(self, guild):
+        self._cache.pop(guild.id, None)
@@ -0,0 +1,95 @@
+import asyncio
+import sys
+import time
+import traceback
+
+import discord
+
+import utils
+
+# Minimum number of seconds between two edits of a progress notice.
+UPDATE_INTERVAL = utils.setting('PROGRESS_UPDATE_INTERVAL', 5)
+
+
+class ProgressReporter:
+    """Shows the progress of a long operation by editing a notice.
+
+    Call `update` as often as you like whenever progress is made; the
+    edits are coalesced so the notice changes at most once every
+    `interval` seconds, and never compete much with the operation
+    itself for the channel's rate limit. `finish` always shows the
+    final state.
+    """
+
+    def __init__(self, notice, render, interval=UPDATE_INTERVAL):
+        self.notice = notice
+        self.render = render
+        self.interval = interval
+        self._shown = notice.content
+        self._last_edit = time.monotonic()
+        self._scheduled = None
+
+    def update(self):
+        if self._scheduled is None:
+            delay = max(0, self._last_edit + self.interval - time.monotonic())
+            self._scheduled = asyncio.ensure_future(self._edit_later(delay))
+
+    async def finish(self, content=None):
+        if self._scheduled is not None:
+            self._scheduled.cancel()
+            self._scheduled = None
+        await self._edit(self.render() if content is None else content)
+
+    async def _edit_later(self, delay):
+        await asyncio.sleep(delay)
+        self._scheduled = None
+        try:
+            await self._edit(self.render())
+        except discord.HTTPException:
+            # A missed progress update isn't worth failing over.
+            pass
+
+    async def _edit(self, content):
+        self._last_edit = time.monotonic()
+        if content != self._shown:
+            self._shown = content
+            await self.notice.edit(content=content)
+
+
+class Jobs:
+    """Long-running background operations, by job ID.
+
+    A job ID is any hashable naming what the job works on, such as
+    `('delete', channel.id)`. Only one job runs per ID, and it can be
+    stopped from another command through `cancel`.
+    """
+
+    def __init__(self, loop):
+        self.loop = loop
+        self._tasks = {}
+
+    def __contains__(self, job_id):
+        return job_id in self._tasks
+
+    def start(self, job_id, coro):
+        task = self.loop.create_task(coro)
+        self._tasks[job_id] = task
+
+        def done(task):
+            del self._tasks[job_id]
+            if not task.cancelled() and task.exception():
+                error = task.exception()
+                print('Ignoring exception in job {!r}'.format(job_id), file=sys.stderr)
+                traceback.print_exception(
+                    type(error), error, error.__traceback__, file=sys.stderr)
+        task.add_done_callback(done)
+        return task
+
+    def cancel(self, job_id):
+        """Stops a job. Returns False if there was no such job running.
+        """
+        task = self._tasks.get(job_id)
+        if task is None:
+            return False
+        task.cancel()
+        return True
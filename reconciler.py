@@ -0,0 +1,176 @@
+import asyncio
+import sys
+import weakref
+
+# Seconds to wait for more changes to a member before editing them.
+COALESCE_DELAY = 0.5
+
+
+def _key(member):
+    return member.guild.id, member.id
+
+
+def _role_ids(roles):
+    return frozenset(role.id for role in roles)
+
+
+class _Batch:
+    def __init__(self, loop):
+        self.changes = []
+        self.touched = set()
+        self.result = loop.create_future()
+
+
+class RoleReconciler:
+    """Funnels every cog's role changes into as few edits as possible.
+
+    Cogs request changes with `update`. Requests for the same member
+    made within a short delay of each other are merged, every
+    registered contributor gets to adjust the resulting set of roles
+    (auto roles, for instance), and the member is edited once. Every
+    caller gets the member's final roles back.
+    """
+
+    def __init__(self, bot):
+        self.bot = bot
+        self._contributors = []
+        # (guild ID, member ID) -> _Batch waiting to be applied
+        self._pending = {}
+        # (guild ID, member ID) -> (role ID sets seen while our edits are
+        # in flight, role IDs set by our last edit)
+        self._applied = {}
+        # (guild ID, member ID) -> lock held while editing the member
+        self._locks = weakref.WeakValueDictionary()
+        # IDs of roles already reported as out of reach
+        self._reported = set()
+
+    def register(self, contributor):
+        """Adds a function that gets the final say on every edit.
+
+        It's called as `contributor(member, roles, changed)`, where
+        `roles` is the set of roles the member is about to get and
+        `changed` the roles that are being added or removed (or were
+        reported as touched), and returns the roles the member should
+        get instead.
+        """
+        self._contributors.append(contributor)
+
+    def is_own_update(self, member):
+        """Whether a member's current roles are the result of our edits.
+
+        Meant for `on_member_update` handlers, to skip the updates
+        echoing edits made through here.
+        """
+        key = _key(member)
+        applied = self._applied.get(key)
+        if applied is None:
+            return False
+        seen, expected = applied
+        role_ids = self.bot.role_views.view(member).ids
+        if role_ids == expected:
+            del self._applied[key]
+            return True
+        return role_ids in seen
+
+    def current_roles(self, member):
+        """A member's roles, including edits Discord hasn't echoed yet.
+        """
+        key = _key(member)
+        applied = self._applied.get(key)
+        if applied is not None:
+            seen, expected = applied
+            if self.bot.role_views.view(member).ids in seen:
+                guild = member.guild
+                return set(filter(None, map(guild.get_role, expected)))
+            del self._applied[key]
+        return set(member.roles)
+
+    def _drop_out_of_reach(self, member, original, roles, requested):
+        # A contributor's own changes are left out when the bot can't
+        # make them, rather than failing the change that was asked for.
+        extra = (roles ^ original) - requested
+        out_of_reach = self.bot.preflight.out_of_reach(member.guild, extra)
+        if not out_of_reach:
+            return roles
+        # Once per role is enough to point out a misplaced role.
+        unreported = [role for role in out_of_reach if role.id not in self._reported]
+        if unreported:
+            self._reported.update(role.id for role in unreported)
+            print('Leaving out roles out of reach in {}: {}'.format(
+                member.guild, ', '.join(role.name for role in unreported)),
+                file=sys.stderr)
+        roles = set(roles)
+        for role in out_of_reach:
+            if role in original:
+                roles.add(role)
+            else:
+                roles.discard(role)
+        return roles
+
+    def lock_for(self, member):
+        key = _key(member)
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        return lock
+
+    async def update(self, member, change=None, *, touched=(), delay=COALESCE_DELAY):
+        """Changes a member's roles and returns their final set of roles.
+
+        `change` takes the set of roles the member has and returns the
+        set they should have. `touched` lists roles that changed
+        outside of the bot, which contributors should re-check.
+        """
+        key = _key(member)
+        batch = self._pending.get(key)
+        if batch is None:
+            batch = self._pending[key] = _Batch(self.bot.loop)
+            self.bot.loop.create_task(self._flush(member, delay))
+        if change is not None:
+            batch.changes.append(change)
+        batch.touched.update(touched)
+        return await asyncio.shield(batch.result)
+
+    async def _flush(self, member, delay):
+        await asyncio.sleep(delay)
+        batch = self._pending.pop(_key(member))
+        try:
+            roles = await self._apply(member, batch)
+        except Exception as e:
+            batch.result.set_exception(e)
+        else:
+            batch.result.set_result(roles)
+
+    async def _apply(self, member, batch):
+        async with self.lock_for(member):
+            member = member.guild.get_member(member.id) or member
+            original = self.current_roles(member)
+
+            roles = set(original)
+            for change in batch.changes:
+                roles = set(change(roles))
+            requested = roles ^ original
+            # Only what callers asked for can fail the edit.
+            self.bot.preflight.check_roles(member.guild, requested)
+            changed = requested | batch.touched
+            for contributor in self._contributors:
+                roles = set(contributor(member, roles, changed))
+            roles = self._drop_out_of_reach(member, original, roles, requested)
+
+            if roles != original:
+                key = _key(member)
+                previous = self._applied.get(key)
+                seen = {self.bot.role_views.view(member).ids}
+                if previous is not None:
+                    seen.update(previous[0])
+                    seen.add(previous[1])
+                self._applied[key] = (frozenset(seen), _role_ids(roles))
+                try:
+                    await member.edit(roles=list(roles))
+                except Exception:
+                    if previous is None:
+                        del self._applied[key]
+                    else:
+                        self._applied[key] = previous
+                    raise
+            return roles
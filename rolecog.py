@@ -8,14 +8,24 @@ class RoleCog(commands.Cog):
     """A base class for cogs that need to manage roles.
 
     Override `key_for_role` to determine which roles are cached and
-    what name (key) they are accessible under.
+    what name (key) they are accessible under. Anything derived from
+    the cached roles of a guild (like a rendered list of them) can be
+    kept with `cached`; it is thrown away whenever those roles change.
     """
 
+    # Whether members who leave and come back get this cog's roles back.
+    sticky = False
+    # Guild settings that change which roles belong to this cog.
+    role_settings = ()
+
     def __init__(self, bot):
         self.bot = bot
         # guild -> key -> set of roles
         self._cache = collections.defaultdict(
             lambda: collections.defaultdict(set))
+        # guild -> name -> value derived from the guild's cached roles
+        self._derived = collections.defaultdict(dict)
+        bot.settings.subscribe(self.settings_changed)
 
     def key_for_role(self, role):
         raise NotImplementedError
@@ -23,8 +33,7 @@ class RoleCog(commands.Cog):
     def rebuild_cache(self, guild=None):
         guilds = [guild] if guild else self.bot.guilds
         for guild in guilds:
-            if guild in self._cache:
-                del self._cache[guild]
+            self._forget_guild(guild)
             for role in guild.roles:
                 self._sync_role(role)
 
@@ -48,15 +57,40 @@ class RoleCog(commands.Cog):
     def all_keys(self, guild):
         return self._cache[guild].keys()
 
+    async def restore_roles(self, guild, roles):
+        """Picks the roles to give back to a member who rejoined.
+
+        `roles` are the member's roles from this cog at the time they
+        left, as far as they still exist.
+        """
+        return roles
+
+    def cached(self, guild, name, compute):
+        derived = self._derived[guild]
+        if name not in derived:
+            derived[name] = compute()
+        return derived[name]
+
+    def settings_changed(self, guild, names):
+        if not names.isdisjoint(self.role_settings):
+            self.rebuild_cache(guild)
+
     def _sync_role(self, role):
         key = self.key_for_role(role)
         if key:
             self._cache[role.guild][key].add(role)
+            self._derived.pop(role.guild, None)
 
     def _remove_role(self, role):
         key = self.key_for_role(role)
         if key:
             self._cache[role.guild][key].remove(role)
+            self._derived.pop(role.guild, None)
+
+    def _forget_guild(self, guild):
+        if guild in self._cache:
+            del self._cache[guild]
+        self._derived.pop(guild, None)
 
     @commands.Cog.listener()
     async def on_ready(self):
@@ -82,5 +116,4 @@ class RoleCog(commands.Cog):
 
     @commands.Cog.listener()
     async def on_guild_remove(self, guild):
-        if self._cache[guild]:
-            del self._cache[guild]
+        self._forget_guild(guild)
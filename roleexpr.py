@@ -0,0 +1,145 @@
+"""A tiny language for describing which roles a member should have.
+
+Expressions combine role names (or role IDs) with `+` (and), `|` (or)
+and `!` (not), using parentheses for grouping. `!` binds tightest and
+`|` loosest, so `a + b | !c` means "(a and b) or not c". Names are
+case-insensitive.
+
+Parsed expressions are plain nested tuples, so they can be used as
+dictionary keys. `compile` turns them into a `Rule`: a disjunction of
+bitmask tests over a `roleindex.RoleIndex`.
+"""
+import re
+
+MAX_TERMS = 256
+
+_tokens_re = re.compile(r'([+|!()])')
+
+
+class ParseError(ValueError):
+    pass
+
+
+def tokenize(text):
+    for part in _tokens_re.split(text):
+        part = part.strip()
+        if part:
+            yield part
+
+
+def parse(text):
+    """Parses an expression into a tree of nested tuples.
+
+    Leaves are `('name', name)`; inner nodes are `('and', children)`,
+    `('or', children)` and `('not', child)`.
+    """
+    parser = _Parser(list(tokenize(text.lower())))
+    expr = parser.parse_or()
+    if parser.peek() is not None:
+        raise ParseError('unexpected "{}"'.format(parser.peek()))
+    return expr
+
+
+class _Parser:
+    def __init__(self, tokens):
+        self._tokens = tokens
+        self._pos = 0
+
+    def peek(self):
+        if self._pos < len(self._tokens):
+            return self._tokens[self._pos]
+
+    def next(self):
+        token = self.peek()
+        if token is None:
+            raise ParseError('unexpected end of expression')
+        self._pos += 1
+        return token
+
+    def parse_or(self):
+        children = [self.parse_and()]
+        while self.peek() == '|':
+            self.next()
+            children.append(self.parse_and())
+        return children[0] if len(children) == 1 else ('or', tuple(children))
+
+    def parse_and(self):
+        children = [self.parse_not()]
+        while self.peek() == '+':
+            self.next()
+            children.append(self.parse_not())
+        return children[0] if len(children) == 1 else ('and', tuple(children))
+
+    def parse_not(self):
+        token = self.next()
+        if token == '!':
+            return ('not', self.parse_not())
+        if token == '(':
+            expr = self.parse_or()
+            if self.next() != ')':
+                raise ParseError('missing ")"')
+            return expr
+        if token in '+|)':
+            raise ParseError('unexpected "{}"'.format(token))
+        return ('name', token)
+
+
+def names(expr):
+    """All the role names (or IDs) an expression refers to.
+    """
+    kind, arg = expr
+    if kind == 'name':
+        return {arg}
+    if kind == 'not':
+        return names(arg)
+    return set().union(*(names(child) for child in arg))
+
+
+class Rule:
+    """A compiled expression.
+
+    `terms` is a list of `(required, forbidden)` mask pairs; a member
+    matches the rule if, for any term, they have every role in
+    `required` and none of the roles in `forbidden`.
+    """
+
+    def __init__(self, terms, names):
+        self.terms = terms
+        self.names = names
+
+    def matches(self, mask):
+        for required, forbidden in self.terms:
+            if mask & required == required and not mask & forbidden:
+                return True
+        return False
+
+
+def compile(expr, index):
+    """Compiles an expression into a `Rule` over the bits of `index`.
+    """
+    return Rule(_terms(expr, index, False), names(expr))
+
+
+def _terms(expr, index, negated):
+    # Converts to disjunctive normal form, pushing negations down to
+    # the leaves with De Morgan's laws.
+    kind, arg = expr
+    if kind == 'name':
+        bit = index.bit(arg)
+        return [(0, bit)] if negated else [(bit, 0)]
+    if kind == 'not':
+        return _terms(arg, index, not negated)
+
+    child_terms = [_terms(child, index, negated) for child in arg]
+    if (kind == 'or') != negated:
+        return [term for terms in child_terms for term in terms]
+
+    result = [(0, 0)]
+    for terms in child_terms:
+        result = [(r1 | r2, f1 | f2)
+                  for r1, f1 in result
+                  for r2, f2 in terms
+                  if not (r1 | r2) & (f1 | f2)]
+        if len(result) > MAX_TERMS:
+            raise ParseError('expression is too complex')
+    return result
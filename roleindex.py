@@ -0,0 +1,126 @@
+import collections
+
+from discord.ext import commands
+
+# Most member role views kept cached at once.
+MAX_VIEWS = 10000
+
+
+class RoleIndex:
+    """Assigns a bit to each role name and role ID seen in a guild.
+
+    A set of roles can then be summarized as a single integer mask,
+    and "does this member have roles X and Y" becomes a couple of
+    integer operations. Bits are never reassigned, so a mask computed
+    for a requirement stays valid as roles come and go.
+    """
+
+    def __init__(self):
+        self._bits = {}
+
+    def bit(self, token):
+        bit = self._bits.get(token)
+        if bit is None:
+            bit = 1 << len(self._bits)
+            self._bits[token] = bit
+        return bit
+
+    def mask(self, tokens):
+        mask = 0
+        for token in tokens:
+            mask |= self.bit(token)
+        return mask
+
+    def mask_for_roles(self, roles):
+        mask = 0
+        for role in roles:
+            mask |= self.mask(role_tokens(role))
+        return mask
+
+
+def role_tokens(role):
+    """The tokens a role can be referred to by: its lowercased name
+    and its ID.
+    """
+    return role.name.lower(), str(role.id)
+
+
+class MemberRoles:
+    """A member's roles, in the shapes role checks want them.
+
+    Get these through `RoleViews.view`, which caches them until the
+    member's roles change.
+    """
+
+    def __init__(self, member, index):
+        roles = member.roles
+        self.ids = frozenset(role.id for role in roles)
+        self.names = frozenset(role.name.lower() for role in roles)
+        self.mask = index.mask_for_roles(roles)
+
+    def has(self, role):
+        return role.id in self.ids
+
+
+class RoleViews(commands.Cog):
+    """Keeps each guild's `RoleIndex`, and cached `MemberRoles` views
+    of the members who were looked at recently.
+
+    At most `max_views` views are kept; the least recently used are
+    dropped first. This should be the first cog added to the bot:
+    listeners run in the order they were added, so other cogs then
+    never see a stale view in their own event handlers.
+    """
+
+    def __init__(self, max_views=MAX_VIEWS):
+        self.max_views = max_views
+        # guild ID -> RoleIndex
+        self._indexes = {}
+        # (guild ID, member ID) -> MemberRoles, least recently used first
+        self._views = collections.OrderedDict()
+
+    def for_guild(self, guild):
+        index = self._indexes.get(guild.id)
+        if index is None:
+            index = self._indexes[guild.id] = RoleIndex()
+        return index
+
+    def view(self, member):
+        key = (member.guild.id, member.id)
+        roles = self._views.get(key)
+        if roles is None:
+            roles = self._views[key] = MemberRoles(member, self.for_guild(member.guild))
+            if len(self._views) > self.max_views:
+                self._views.popitem(last=False)
+        else:
+            self._views.move_to_end(key)
+        return roles
+
+    def invalidate(self, member):
+        self._views.pop((member.guild.id, member.id), None)
+
+    def invalidate_guild(self, guild):
+        for key in [key for key in self._views if key[0] == guild.id]:
+            del self._views[key]
+
+    @commands.Cog.listener()
+    async def on_member_update(self, before, after):
+        self.invalidate(after)
+
+    @commands.Cog.listener()
+    async def on_member_remove(self, member):
+        self.invalidate(member)
+
+    @commands.Cog.listener()
+    async def on_guild_role_update(self, old, new):
+        if old.name != new.name:
+            self.invalidate_guild(new.guild)
+
+    @commands.Cog.listener()
+    async def on_guild_role_delete(self, role):
+        self.invalidate_guild(role.guild)
+
+    @commands.Cog.listener()
+    async def on_guild_remove(self, guild):
+        self.invalidate_guild(guild)
+        self._indexes.pop(guild.id, None)
@@ -0,0 +1,115 @@
+import re
+
+_words_re = re.compile(r'[\s,"]+')
+
+# Marks a trie node where a role name ends.
+_END = None
+
+
+def words(text):
+    return [w for w in _words_re.split(text.lower()) if w]
+
+
+def edit_distance(a, b, limit=None):
+    """Computes the Levenshtein distance between two strings.
+
+    If `limit` is given, gives up and returns `limit + 1` as soon as
+    the distance is known to exceed it.
+    """
+    if len(a) < len(b):
+        a, b = b, a
+    if limit is not None and len(a) - len(b) > limit:
+        return limit + 1
+
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1,
+                               current[j - 1] + 1,
+                               previous[j - 1] + (ca != cb)))
+        if limit is not None and min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+class RoleTrie:
+    """Finds role names, which may span several words, in a text.
+
+    Names are stored word by word, so a text can be split into the
+    longest names it contains in a single pass over its words.
+    """
+
+    def __init__(self):
+        self._root = {}
+        # canonical name -> name as it was added
+        self._names = {}
+
+    def add(self, name):
+        node = self._root
+        for word in words(name):
+            node = node.setdefault(word, {})
+        node[_END] = name
+        self._names[' '.join(words(name))] = name
+
+    def remove(self, name):
+        path = [self._root]
+        for word in words(name):
+            node = path[-1].get(word)
+            if node is None:
+                return
+            path.append(node)
+        path[-1].pop(_END, None)
+        self._names.pop(' '.join(words(name)), None)
+
+        # Prune the branches that no longer lead anywhere.
+        name_words = words(name)
+        for i in range(len(name_words), 0, -1):
+            if path[i]:
+                break
+            del path[i - 1][name_words[i - 1]]
+
+    def parse(self, text):
+        """Splits a text into the names it contains.
+
+        Returns a list of names found, and a list of the phrases in
+        between that didn't match any name.
+        """
+        text_words = words(text)
+        found, not_found = [], []
+        unknown = []
+        i = 0
+        while i < len(text_words):
+            node = self._root
+            match, end = None, i
+            for j in range(i, len(text_words)):
+                node = node.get(text_words[j])
+                if node is None:
+                    break
+                if _END in node:
+                    match, end = node[_END], j + 1
+            if match is None:
+                unknown.append(text_words[i])
+                i += 1
+                continue
+            if unknown:
+                not_found.append(' '.join(unknown))
+                unknown = []
+            found.append(match)
+            i = end
+        if unknown:
+            not_found.append(' '.join(unknown))
+        return found, not_found
+
+    def suggest(self, phrase):
+        """Finds the name closest to a misspelled one, if any is close.
+        """
+        phrase = ' '.join(words(phrase))
+        limit = max(1, len(phrase) // 4)
+        best, best_distance = None, limit + 1
+        for canonical, name in self._names.items():
+            distance = edit_distance(phrase, canonical, limit=best_distance - 1)
+            if distance < best_distance:
+                best, best_distance = name, distance
+        return best
@@ -1,3 +1,8 @@
+STORAGE_PATH = 'irisbot.sqlite3'
+PROGRESS_UPDATE_INTERVAL = 5
+ARCHIVE_PATH = 'archives'
+
+BOT_COMMAND_PREFIX = '?'
 BOT_CHANNEL_WHITELIST = []
 BOT_CHANNEL_BLACKLIST = []
 BOT_CHANNEL_REGEX = r'^bots?($|[-_].*)'
@@ -9,6 +14,7 @@ BOT_SUPERUSER_ROLES = ['admin', 'administrator', 'mod', 'moderator']
 OPT_ROLE_PREFIX = 'In:'
 
 AUTO_ROLE_PREFIX = '(Auto)'
+AUTO_ROLE_JOB_WORKERS = 4
 
 COLORS_ROLE_PREFIX = ''
 COLORS_LIMIT_PALETTE = False
@@ -0,0 +1,104 @@
+import asyncio
+import struct
+
+from discord.ext import commands
+
+import preflight
+from rolecog import RoleCog
+
+# Seconds between writes of departed members' roles to the database.
+FLUSH_INTERVAL = 10
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS sticky_roles (
+    guild_id INTEGER NOT NULL,
+    member_id INTEGER NOT NULL,
+    role_ids BLOB NOT NULL,
+    PRIMARY KEY (guild_id, member_id)
+);
+'''
+
+
+def pack_ids(ids):
+    return struct.pack('<{}Q'.format(len(ids)), *ids)
+
+
+def unpack_ids(data):
+    return struct.unpack('<{}Q'.format(len(data) // 8), data)
+
+
+class StickyRoles(commands.Cog, name='Sticky Roles'):
+    """Gives members who leave and rejoin their self-assigned roles back.
+
+    When a member leaves, the roles managed by sticky role cogs (opt-in
+    roles and colors) are remembered; when they rejoin, those roles and
+    any auto roles they imply are restored with a single edit.
+    """
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.bot.storage.declare(SCHEMA)
+        # (guild ID, member ID) -> packed role IDs, or None to forget
+        # the member; waiting to be written to the database.
+        self._pending = {}
+        self._flusher = None
+
+    def sticky_cogs(self):
+        return [cog for cog in self.bot.cogs.values()
+                if isinstance(cog, RoleCog) and cog.sticky]
+
+    @commands.Cog.listener()
+    async def on_member_remove(self, member):
+        role_ids = [role.id for role in member.roles
+                    if any(cog.key_for_role(role) for cog in self.sticky_cogs())]
+        if role_ids:
+            self._pending[(member.guild.id, member.id)] = pack_ids(role_ids)
+            self.schedule_flush()
+
+    @commands.Cog.listener()
+    async def on_member_join(self, member):
+        guild = member.guild
+        key = (guild.id, member.id)
+        if key in self._pending:
+            data = self._pending[key]
+        else:
+            row = await self.bot.storage.fetchone(
+                'SELECT role_ids FROM sticky_roles WHERE guild_id = ? AND member_id = ?',
+                key)
+            data = row and row[0]
+        if not data:
+            return
+
+        self._pending[key] = None
+        self.schedule_flush()
+
+        roles = list(filter(None, map(guild.get_role, unpack_ids(data))))
+        try:
+            restored = set()
+            for cog in self.sticky_cogs():
+                mine = [role for role in roles if cog.key_for_role(role)]
+                restored.update(await cog.restore_roles(guild, mine))
+            # Give back what can be given back, even if some roles are
+            # now above the bot's own.
+            restored.difference_update(self.bot.preflight.out_of_reach(guild, restored))
+            if restored:
+                await self.bot.reconciler.update(
+                    member, lambda roles: roles | restored, touched=restored)
+        except preflight.PreflightError:
+            pass
+
+    def schedule_flush(self):
+        if self._flusher is None:
+            self._flusher = self.bot.loop.create_task(self.flush_later())
+
+    async def flush_later(self):
+        await asyncio.sleep(FLUSH_INTERVAL)
+        self._flusher = None
+        pending, self._pending = self._pending, {}
+        await self.bot.storage.executemany(
+            'INSERT OR REPLACE INTO sticky_roles (guild_id, member_id, role_ids) '
+            'VALUES (?, ?, ?)',
+            [key + (data,) for key, data in pending.items() if data is not None])
+        await self.bot.storage.executemany(
+            'DELETE FROM sticky_roles WHERE guild_id = ? AND member_id = ?',
+            [key for key, data in pending.items() if data is None])
@@ -0,0 +1,64 @@
+import asyncio
+import concurrent.futures
+import sqlite3
+
+import utils
+
+DATABASE_PATH = utils.setting('STORAGE_PATH', 'irisbot.sqlite3')
+
+
+class Storage:
+    """A small asynchronous wrapper around a SQLite database.
+
+    All queries run on a single worker thread, so they never block the
+    event loop and never race each other. Modules declare the tables
+    they need with `declare`; pending declarations are applied before
+    the next query runs.
+    """
+
+    def __init__(self, path=DATABASE_PATH):
+        self._path = path
+        self._conn = None
+        self._schemas = []
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+    def declare(self, schema):
+        self._schemas.append(schema)
+
+    def _connect(self):
+        # Only ever called from the worker thread.
+        if self._conn is None:
+            self._conn = sqlite3.connect(self._path)
+        while self._schemas:
+            self._conn.executescript(self._schemas.pop(0))
+        return self._conn
+
+    def _run(self, fn):
+        loop = asyncio.get_event_loop()
+        return loop.run_in_executor(self._executor, fn)
+
+    async def execute(self, sql, params=()):
+        def run():
+            conn = self._connect()
+            with conn:
+                conn.execute(sql, params)
+        await self._run(run)
+
+    async def executemany(self, sql, seq_of_params):
+        seq_of_params = list(seq_of_params)
+
+        def run():
+            conn = self._connect()
+            with conn:
+                conn.executemany(sql, seq_of_params)
+        await self._run(run)
+
+    async def fetchall(self, sql, params=()):
+        def run():
+            return self._connect().execute(sql, params).fetchall()
+        return await self._run(run)
+
+    async def fetchone(self, sql, params=()):
+        def run():
+            return self._connect().execute(sql, params).fetchone()
+        return await self._run(run)
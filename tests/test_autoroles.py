@@ -0,0 +1,123 @@
+import random
+import unittest
+
+import autoroles
+import roleexpr
+import roleindex
+
+
+class Role:
+    def __init__(self, id, name):
+        self.id = id
+        self.name = name
+
+    def __repr__(self):
+        return self.name
+
+
+class Member:
+    def __init__(self, roles):
+        self.roles = roles
+
+
+class Guild:
+    id = 1
+
+
+class Settings:
+    def subscribe(self, callback):
+        pass
+
+    def get(self, guild, name):
+        return '(Auto)'
+
+    def derived(self, guild, key, compute):
+        return compute()
+
+
+class Bot:
+    def __init__(self):
+        self.settings = Settings()
+        self.storage = self
+        self.reconciler = self
+        self.role_views = roleindex.RoleViews()
+
+    def declare(self, schema):
+        pass
+
+    def register(self, contributor):
+        pass
+
+
+class RuleSetTest(unittest.TestCase):
+    def setUp(self):
+        self.a, self.b, self.c, self.d = (Role(i, name) for i, name in enumerate('ABCD', 1))
+        self.both = Role(10, '(Auto) both')
+        self.either = Role(11, '(Auto) either')
+        # Depends on another auto role, by ID.
+        self.chained = Role(12, '(Auto) chained')
+        self.rules = autoroles.RuleSet(roleindex.RoleIndex())
+        self.rules.add(self.both, roleexpr.parse('a + b'))
+        self.rules.add(self.either, roleexpr.parse('c | !d'))
+        self.rules.add(self.chained, roleexpr.parse('10 + !c'))
+
+    def test_evaluate(self):
+        to_add, to_remove = self.rules.evaluate(Member([self.a, self.b, self.d]))
+        self.assertEqual(set(to_add), {self.both, self.chained})
+        self.assertEqual(to_remove, [])
+
+        to_add, to_remove = self.rules.evaluate(Member([self.a, self.c, self.both, self.chained]))
+        self.assertEqual(set(to_add), {self.either})
+        self.assertEqual(set(to_remove), {self.both, self.chained})
+
+    def test_order(self):
+        order = self.rules.order()
+        self.assertLess(order.index(self.both), order.index(self.chained))
+        self.assertEqual(self.rules.cyclic(), set())
+
+    def test_plan_agrees_with_evaluate(self):
+        rng = random.Random(1)
+        pool = [self.a, self.b, self.c, self.d, self.both, self.either, self.chained]
+        members = [Member([role for role in pool if rng.random() < 0.4]) for _ in range(300)]
+
+        planned = [(set(), set()) for _ in members]
+        for role, adds, removes in self.rules.plan(members):
+            for i in range(len(members)):
+                if adds >> i & 1:
+                    planned[i][0].add(role)
+                if removes >> i & 1:
+                    planned[i][1].add(role)
+
+        for member, expected in zip(members, planned):
+            to_add, to_remove = self.rules.evaluate(member)
+            self.assertEqual((set(to_add), set(to_remove)), expected, member.roles)
+
+
+class AutoRolesTest(unittest.TestCase):
+    def setUp(self):
+        self.cog = autoroles.AutoRoles(Bot())
+        self.guild = Guild()
+
+    def role(self, id, name):
+        role = Role(id, name)
+        role.guild = self.guild
+        return role
+
+    def test_recognizes_auto_roles(self):
+        role = self.role(10, '(Auto) a + b')
+        self.cog._sync_role(role)
+        self.assertEqual(self.cog.rules_for(self.guild).rules.keys(), {role})
+
+    def test_ignores_invalid_rules(self):
+        too_complex = ' + '.join('(a{0}|b{0})'.format(i) for i in range(9))
+        roles = [self.role(10, '(Auto) a +'), self.role(11, '(Auto) ' + too_complex),
+                 self.role(12, 'a + b')]
+        for role in roles:
+            self.assertIsNone(self.cog.key_for_role(role), role.name)
+            self.cog._sync_role(role)
+        self.assertEqual(self.cog.rules_for(self.guild).rules, {})
+        self.assertEqual(list(self.cog.all_roles(self.guild)), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
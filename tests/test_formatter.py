@@ -0,0 +1,71 @@
+import unittest
+
+import formatter
+
+
+def section(name, count, width=40):
+    block = formatter.HelpSection(name=name)
+    for i in range(count):
+        block.add_line('{} {}'.format(name, i).ljust(width, '.'))
+    return block
+
+
+def content_lines(pages):
+    return [line for page in pages for line in page.split('\n')
+            if line and "(cont'd)" not in line]
+
+
+class PaginatorTest(unittest.TestCase):
+    def test_fits_on_one_page(self):
+        block = formatter.TextBlock()
+        block.add_line('one')
+        block.add_line('two')
+        self.assertEqual(block.render_pages(2000), [block.render()])
+
+    def test_pages_respect_max_size(self):
+        block = formatter.TextBlock()
+        for name in 'abcde':
+            block.append(section(name, 30))
+        for max_size in [100, 300, 2000]:
+            pages = block.render_pages(max_size)
+            for page in pages:
+                self.assertLessEqual(len(page), max_size)
+            self.assertEqual(content_lines(pages), content_lines([block.render()]))
+
+    def test_continued_header(self):
+        block = formatter.TextBlock()
+        block.append(section('Roles', 60))
+        pages = block.render_pages(500)
+        self.assertGreater(len(pages), 1)
+        self.assertTrue(pages[0].startswith('**Roles**\n'))
+        for page in pages[1:]:
+            self.assertTrue(page.startswith("**Roles**(cont'd)\n"), page[:30])
+
+    def test_section_moves_to_next_page_rather_than_split(self):
+        block = formatter.TextBlock()
+        block.append(section('First', 8))
+        block.append(section('Second', 8))
+        pages = block.render_pages(500)
+        self.assertEqual(len(pages), 2)
+        self.assertTrue(pages[1].startswith('**Second**\n'))
+        self.assertNotIn("(cont'd)", ''.join(pages))
+
+    def test_prefix_and_suffix_on_every_page(self):
+        block = formatter.TextBlock(prefix='```\n', suffix='```')
+        for i in range(100):
+            block.add_line('line {}'.format(i))
+        pages = block.render_pages(200)
+        self.assertGreater(len(pages), 1)
+        for page in pages:
+            self.assertLessEqual(len(page), 200)
+            self.assertTrue(page.startswith('```\n') and page.endswith('```'))
+
+    def test_oversized_line(self):
+        block = formatter.TextBlock()
+        block.add_line('x' * 300)
+        with self.assertRaises(RuntimeError):
+            block.render_pages(200)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import datetime
+import unittest
+
+import messagefilters
+
+
+class Guild:
+    def get_member_named(self, name):
+        return None
+
+
+class Author:
+    def __init__(self, id):
+        self.id = id
+
+
+class Message:
+    def __init__(self, author_id, content, attachments=()):
+        self.author = Author(author_id)
+        self.content = content
+        self.attachments = list(attachments)
+        self.embeds = []
+
+
+class ParseTest(unittest.TestCase):
+    def parse(self, text):
+        return messagefilters.parse(Guild(), text)
+
+    def test_filters_and_rest(self):
+        selected, rest = self.parse('20 from:<@!123> matching:"free nitro" has:link')
+        self.assertEqual(rest, ['20'])
+        self.assertTrue(selected)
+        self.assertTrue(selected(Message(123, 'Free Nitro at https://example.com')))
+        self.assertFalse(selected(Message(456, 'free nitro https://example.com')))
+        self.assertFalse(selected(Message(123, 'free nitro')))
+
+    def test_no_filters(self):
+        selected, rest = self.parse('all of it')
+        self.assertFalse(selected)
+        self.assertEqual(rest, ['all', 'of', 'it'])
+
+    def test_dates(self):
+        selected, _ = self.parse('after:2020-01-31 before:2d')
+        self.assertEqual(selected.after, datetime.datetime(2020, 1, 31))
+        ago = datetime.datetime.utcnow() - selected.before
+        self.assertAlmostEqual(ago.total_seconds(), 2 * 86400, delta=60)
+
+    def test_errors(self):
+        for text in ['matching:"(unclosed"', 'has:cats', 'before:someday',
+                     'after:2020-13-45', 'from:nobody', 'color:red']:
+            with self.assertRaises(messagefilters.FilterError, msg=text):
+                self.parse(text)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+import asyncio
+import unittest
+
+import optroles
+import roleindex
+import storage
+
+
+class Role:
+    def __init__(self, id, name, guild):
+        self.id = id
+        self.name = name
+        self.guild = guild
+
+
+class Guild:
+    id = 1
+
+
+class Member:
+    id = 2
+    guild = Guild()
+
+    def __init__(self):
+        self.roles = []
+
+
+class Settings:
+    def subscribe(self, callback):
+        pass
+
+    def get(self, guild, name):
+        return 'In:'
+
+
+class Reconciler:
+    def __init__(self, bot):
+        self.bot = bot
+
+    async def update(self, member, change):
+        member.roles = list(change(set(member.roles)))
+        self.bot.role_views.invalidate(member)
+
+
+class Bot:
+    def __init__(self, loop):
+        self.loop = loop
+        self.settings = Settings()
+        self.storage = storage.Storage(':memory:')
+        self.role_views = roleindex.RoleViews()
+        self.reconciler = Reconciler(self)
+
+
+class Context:
+    def __init__(self, author):
+        self.message = self
+        self.author = author
+        self.replies = []
+
+    async def reply(self, content):
+        self.replies.append(content)
+
+
+class SplitDurationTest(unittest.TestCase):
+    def test_split(self):
+        self.assertEqual(optroles.split_duration('lfg for 2h'), ('lfg', 7200))
+        self.assertEqual(optroles.split_duration('lfg, raids for 1d 12h'),
+                         ('lfg, raids', 36 * 3600))
+
+    def test_splits_at_the_last_for(self):
+        self.assertEqual(optroles.split_duration('looking for group for 2h'),
+                         ('looking for group', 7200))
+        self.assertEqual(optroles.split_duration('looking for group FOR 30m'),
+                         ('looking for group', 1800))
+
+    def test_no_duration(self):
+        for text in ['lfg', 'looking for group', 'looking for group for ever']:
+            self.assertEqual(optroles.split_duration(text), (text, None))
+
+
+class ExpiryTest(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.cog = optroles.OptRoles(Bot(self.loop))
+        self.member = Member()
+        self.ctx = Context(self.member)
+        self.lfg = Role(10, 'In: lfg', Member.guild)
+        self.raids = Role(11, 'In: raids', Member.guild)
+
+    def tearDown(self):
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def run_async(self, coro):
+        return self.loop.run_until_complete(coro)
+
+    def expires_at(self, role):
+        return self.cog.expirations.expires_at(self.member, role)
+
+    def test_join_for_a_while(self):
+        self.run_async(self.cog.join_roles(self.ctx, [self.lfg], 7200))
+        self.assertEqual(self.member.roles, [self.lfg])
+        self.assertIsNotNone(self.expires_at(self.lfg))
+
+    def test_leave_cancels_expiration_given_a_generator(self):
+        # `leave all` passes the cog's roles as a generator.
+        self.run_async(self.cog.join_roles(self.ctx, [self.lfg], 7200))
+        self.run_async(self.cog.leave_roles(self.ctx, (role for role in [self.lfg, self.raids])))
+        self.assertEqual(self.member.roles, [])
+        self.assertIsNone(self.expires_at(self.lfg))
+
+    def test_join_without_duration_cancels_expiration(self):
+        self.run_async(self.cog.join_roles(self.ctx, [self.lfg], 7200))
+        self.run_async(self.cog.join_roles(self.ctx, [self.lfg]))
+        self.assertEqual(self.member.roles, [self.lfg])
+        self.assertIsNone(self.expires_at(self.lfg))
+
+    def test_default_expiry_is_kept(self):
+        self.cog._default_expiry[self.lfg.id] = 600
+        self.run_async(self.cog.join_roles(self.ctx, (role for role in [self.lfg])))
+        self.assertIsNotNone(self.expires_at(self.lfg))
+
+
+if __name__ == '__main__':
+    unittest.main()
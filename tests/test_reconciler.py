@@ -0,0 +1,154 @@
+import asyncio
+import contextlib
+import io
+import unittest
+
+import preflight
+import reconciler
+import roleindex
+
+
+class Role:
+    def __init__(self, id, name, position):
+        self.id = id
+        self.name = name
+        self.position = position
+        self.managed = False
+
+    def __repr__(self):
+        return self.name
+
+
+class Permissions:
+    manage_roles = True
+
+
+class Me:
+    def __init__(self, top_role):
+        self.top_role = top_role
+        self.guild_permissions = Permissions()
+
+
+class Guild:
+    id = 1
+
+    def __init__(self, roles, top_role):
+        self._roles = {role.id: role for role in roles}
+        self.me = Me(top_role)
+        self.members = {}
+
+    def get_role(self, role_id):
+        return self._roles.get(role_id)
+
+    def get_member(self, member_id):
+        return self.members.get(member_id)
+
+
+class Member:
+    id = 2
+
+    def __init__(self, guild):
+        self.guild = guild
+        self.roles = []
+        self.edits = []
+        self.fail = False
+        guild.members[self.id] = self
+
+    async def edit(self, roles):
+        if self.fail:
+            raise RuntimeError('edit failed')
+        self.edits.append(set(roles))
+
+
+class Bot:
+    def __init__(self, loop):
+        self.loop = loop
+        self.role_views = roleindex.RoleViews()
+        self.preflight = preflight.Preflight(self)
+        self.reconciler = reconciler.RoleReconciler(self)
+
+
+class ReconcilerTest(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.a = Role(10, 'a', 1)
+        self.b = Role(11, 'b', 2)
+        self.high = Role(12, 'high', 50)
+        guild = Guild([self.a, self.b, self.high], Role(13, 'bot', 10))
+        self.member = Member(guild)
+        self.bot = Bot(self.loop)
+        self.reconciler = self.bot.reconciler
+
+    def tearDown(self):
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def run_async(self, coro):
+        return self.loop.run_until_complete(coro)
+
+    def update(self, change, **kwargs):
+        return self.reconciler.update(self.member, change, delay=0.01, **kwargs)
+
+    def echo(self):
+        # Discord reporting the member's new roles back to us.
+        self.member.roles = list(self.member.edits[-1])
+        self.bot.role_views.invalidate(self.member)
+
+    def test_updates_in_one_window_make_one_edit(self):
+        results = self.run_async(asyncio.gather(
+            self.update(lambda roles: roles | {self.a}),
+            self.update(lambda roles: roles | {self.b})))
+        self.assertEqual(self.member.edits, [{self.a, self.b}])
+        self.assertEqual(results, [{self.a, self.b}] * 2)
+
+    def test_later_update_sees_unechoed_edit(self):
+        self.run_async(self.update(lambda roles: roles | {self.a}))
+        self.run_async(self.update(lambda roles: roles | {self.b}))
+        self.assertEqual(self.member.edits, [{self.a}, {self.a, self.b}])
+
+    def test_own_echo_is_skipped(self):
+        self.run_async(self.update(lambda roles: roles | {self.a}))
+        # Until the echo arrives, the old roles are ours too.
+        self.assertTrue(self.reconciler.is_own_update(self.member))
+        self.echo()
+        self.assertTrue(self.reconciler.is_own_update(self.member))
+        # After that, changes are someone else's.
+        self.member.roles = [self.a, self.b]
+        self.bot.role_views.invalidate(self.member)
+        self.assertFalse(self.reconciler.is_own_update(self.member))
+
+    def test_failed_edit_restores_applied(self):
+        self.run_async(self.update(lambda roles: roles | {self.a}))
+        applied = dict(self.reconciler._applied)
+        self.member.fail = True
+        with self.assertRaises(RuntimeError):
+            self.run_async(self.update(lambda roles: roles | {self.b}))
+        self.assertEqual(self.reconciler._applied, applied)
+
+        self.member.fail = False
+        self.echo()
+        self.assertTrue(self.reconciler.is_own_update(self.member))
+        self.member.fail = True
+        with self.assertRaises(RuntimeError):
+            self.run_async(self.update(lambda roles: roles | {self.b}))
+        self.assertEqual(self.reconciler._applied, {})
+
+    def test_requested_role_out_of_reach_fails(self):
+        with self.assertRaises(preflight.PreflightError):
+            self.run_async(self.update(lambda roles: roles | {self.high}))
+        self.assertEqual(self.member.edits, [])
+
+    def test_contributed_role_out_of_reach_is_left_out(self):
+        self.reconciler.register(lambda member, roles, changed: roles | {self.high})
+        stderr = io.StringIO()
+        with contextlib.redirect_stderr(stderr):
+            self.run_async(self.update(lambda roles: roles | {self.a}))
+            self.echo()
+            self.run_async(self.update(lambda roles: roles | {self.b}))
+        self.assertEqual(self.member.edits, [{self.a}, {self.a, self.b}])
+        self.assertEqual(stderr.getvalue().count('high'), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
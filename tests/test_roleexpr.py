@@ -0,0 +1,72 @@
+import unittest
+
+import roleexpr
+import roleindex
+
+
+def matches(text, names):
+    index = roleindex.RoleIndex()
+    rule = roleexpr.compile(roleexpr.parse(text), index)
+    return rule.matches(index.mask(names))
+
+
+class ParseTest(unittest.TestCase):
+    def test_precedence(self):
+        self.assertEqual(roleexpr.parse('A + b | !c'),
+                         ('or', (('and', (('name', 'a'), ('name', 'b'))),
+                                 ('not', ('name', 'c')))))
+
+    def test_parentheses(self):
+        self.assertEqual(roleexpr.parse('a + (b | c)'),
+                         ('and', (('name', 'a'),
+                                  ('or', (('name', 'b'), ('name', 'c'))))))
+
+    def test_errors(self):
+        for text in ['', 'a +', 'a + (b', 'a b)', '| a', 'a + + b']:
+            with self.assertRaises(roleexpr.ParseError, msg=text):
+                roleexpr.parse(text)
+
+    def test_names(self):
+        self.assertEqual(roleexpr.names(roleexpr.parse('a + !(b | c)')), {'a', 'b', 'c'})
+
+
+class CompileTest(unittest.TestCase):
+    def test_and_or_not(self):
+        self.assertTrue(matches('a + b', ['a', 'b']))
+        self.assertFalse(matches('a + b', ['a']))
+        self.assertTrue(matches('a | b', ['b']))
+        self.assertTrue(matches('!a', []))
+        self.assertFalse(matches('!a', ['a']))
+
+    def test_de_morgan(self):
+        for names in [[], ['a'], ['b'], ['a', 'b']]:
+            self.assertEqual(matches('!(a + b)', names),
+                             matches('!a | !b', names), names)
+            self.assertEqual(matches('!(a | b)', names),
+                             matches('!a + !b', names), names)
+
+    def test_dnf_terms(self):
+        index = roleindex.RoleIndex()
+        rule = roleexpr.compile(roleexpr.parse('(a | b) + (c | d)'), index)
+        self.assertEqual(len(rule.terms), 4)
+        a, b, c, d = (index.bit(name) for name in 'abcd')
+        self.assertEqual(set(rule.terms), {(a | c, 0), (a | d, 0), (b | c, 0), (b | d, 0)})
+
+    def test_contradictions_are_dropped(self):
+        index = roleindex.RoleIndex()
+        rule = roleexpr.compile(roleexpr.parse('a + !a'), index)
+        self.assertEqual(rule.terms, [])
+        self.assertFalse(rule.matches(index.mask(['a'])))
+
+    def test_max_terms(self):
+        # Each (x | y) doubles the number of terms.
+        text = ' + '.join('(a{0} | b{0})'.format(i) for i in range(9))
+        with self.assertRaises(roleexpr.ParseError):
+            roleexpr.compile(roleexpr.parse(text), roleindex.RoleIndex())
+        text = ' + '.join('(a{0} | b{0})'.format(i) for i in range(8))
+        rule = roleexpr.compile(roleexpr.parse(text), roleindex.RoleIndex())
+        self.assertEqual(len(rule.terms), roleexpr.MAX_TERMS)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import unittest
+
+import rolematch
+
+
+class RoleTrieTest(unittest.TestCase):
+    def setUp(self):
+        self.trie = rolematch.RoleTrie()
+        for name in ['LFG', 'Looking for Group', 'Looking', 'Raids']:
+            self.trie.add(name)
+
+    def test_longest_match(self):
+        found, not_found = self.trie.parse('looking for group, raids')
+        self.assertEqual(found, ['Looking for Group', 'Raids'])
+        self.assertEqual(not_found, [])
+
+    def test_falls_back_to_shorter_match(self):
+        found, not_found = self.trie.parse('looking for raids')
+        self.assertEqual(found, ['Looking', 'Raids'])
+        self.assertEqual(not_found, ['for'])
+
+    def test_unknown_phrases(self):
+        found, not_found = self.trie.parse('pvp lfg trading post')
+        self.assertEqual(found, ['LFG'])
+        self.assertEqual(not_found, ['pvp', 'trading post'])
+
+    def test_remove_keeps_other_names(self):
+        self.trie.remove('Looking')
+        found, not_found = self.trie.parse('looking for group looking')
+        self.assertEqual(found, ['Looking for Group'])
+        self.assertEqual(not_found, ['looking'])
+
+    def test_remove_prunes_branches(self):
+        self.trie.remove('Looking for Group')
+        self.assertEqual(self.trie._root['looking'], {rolematch._END: 'Looking'})
+        self.trie.remove('Looking')
+        self.assertNotIn('looking', self.trie._root)
+
+    def test_suggest(self):
+        self.assertEqual(self.trie.suggest('raid'), 'Raids')
+        self.assertEqual(self.trie.suggest('lookin for grop'), 'Looking for Group')
+        self.assertIsNone(self.trie.suggest('trading'))
+
+
+class EditDistanceTest(unittest.TestCase):
+    def test_distance(self):
+        self.assertEqual(rolematch.edit_distance('kitten', 'sitting'), 3)
+        self.assertEqual(rolematch.edit_distance('', 'abc'), 3)
+        self.assertEqual(rolematch.edit_distance('same', 'same'), 0)
+
+    def test_limit(self):
+        self.assertEqual(rolematch.edit_distance('kitten', 'sitting', limit=1), 2)
+        self.assertEqual(rolematch.edit_distance('a', 'abcdef', limit=2), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
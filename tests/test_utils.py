@@ -0,0 +1,24 @@
+import unittest
+
+import utils
+
+
+class DurationTest(unittest.TestCase):
+    def test_parse(self):
+        self.assertEqual(utils.parse_duration('2h'), 7200)
+        self.assertEqual(utils.parse_duration('1d 12h'), 36 * 3600)
+        self.assertEqual(utils.parse_duration(' 1W2d '), 9 * 24 * 3600)
+        self.assertEqual(utils.parse_duration('90s'), 90)
+
+    def test_parse_rejects_other_text(self):
+        for text in ['', 'group', '2 hours', '2h lfg', 'h']:
+            self.assertIsNone(utils.parse_duration(text), text)
+
+    def test_pretty(self):
+        self.assertEqual(utils.pretty_duration(7200), '2 hours')
+        self.assertEqual(utils.pretty_duration(90061), '1 day, 1 hour, 1 minute, and 1 second')
+        self.assertEqual(utils.pretty_duration(0.5), 'no time')
+
+
+if __name__ == '__main__':
+    unittest.main()
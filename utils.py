@@ -1,6 +1,8 @@
 import aiohttp
+import collections
 import inspect
 import io
+import re
 
 import discord
 from discord.ext import commands
@@ -29,6 +31,35 @@ def pretty_list(names, bold=True, conjunction='and', empty=''):
         return '{},{} {}'.format(', '.join(names[:-1]), sep, names[-1])
 
 
+_duration_re = re.compile(r'(\d+) *([wdhms])')
+_duration_units = [('week', 'w', 7 * 24 * 60 * 60),
+                   ('day', 'd', 24 * 60 * 60),
+                   ('hour', 'h', 60 * 60),
+                   ('minute', 'm', 60),
+                   ('second', 's', 1)]
+
+
+def parse_duration(text):
+    """Parses a duration like "2h" or "1d 12h" into seconds.
+
+    Returns None if the text isn't a duration.
+    """
+    text = text.strip().lower()
+    if not re.fullmatch(r'(\d+ *[wdhms] *)+', text):
+        return None
+    seconds = {symbol: size for _, symbol, size in _duration_units}
+    return sum(int(n) * seconds[unit] for n, unit in _duration_re.findall(text))
+
+
+def pretty_duration(seconds):
+    parts = []
+    for name, _, size in _duration_units:
+        n, seconds = divmod(int(seconds), size)
+        if n:
+            parts.append('{} {}{}'.format(n, name, '' if n == 1 else 's'))
+    return pretty_list(parts, bold=False, empty='no time')
+
+
 def is_local_check_failure(error):
     """This horrible hack lets a command error handler figure out if the
     error originates from the command's own checks, rather than a
@@ -49,6 +80,62 @@ class Bot(commands.Bot):
     """A subclass of `discord.ext.commands.Bot` with some improvements.
     """
 
+    def __init__(self, *args, allow_dms=True, **kwargs):
+        # Rendered help, cleared whenever the set of commands changes.
+        # Set before anything can add a command.
+        self.help_cache = {}
+        self.allow_dms = allow_dms
+        # Why messages were ignored without looking for a command, and
+        # how many weren't.
+        self.message_stats = collections.Counter()
+        super().__init__(*args, **kwargs)
+
+    def add_command(self, command):
+        super().add_command(command)
+        self.help_cache.clear()
+
+    def remove_command(self, name):
+        command = super().remove_command(name)
+        self.help_cache.clear()
+        return command
+
+    def add_cog(self, cog):
+        super().add_cog(cog)
+        self.help_cache.clear()
+
+    def remove_cog(self, name):
+        super().remove_cog(name)
+        self.help_cache.clear()
+
+    def quick_prefixes(self, message):
+        """The command prefixes for a message, if they can be told
+        without awaiting anything. Override this if `command_prefix`
+        is a function.
+        """
+        prefix = self.command_prefix
+        if isinstance(prefix, str):
+            return (prefix,)
+        if isinstance(prefix, (list, tuple)):
+            return tuple(prefix)
+        return None
+
+    def ignore_reason(self, message):
+        """Cheaply rules out messages that can't be commands, before
+        any context is built.
+        """
+        if message.author.bot:
+            return 'bot'
+        if message.guild is None and not self.allow_dms:
+            return 'dm'
+        prefixes = self.quick_prefixes(message)
+        if prefixes is not None and not message.content.startswith(prefixes):
+            return 'prefix'
+        return None
+
     async def on_message(self, message):
+        reason = self.ignore_reason(message)
+        self.message_stats[reason or 'passed'] += 1
+        if reason:
+            return
         ctx = await self.get_context(message, cls=IrisContext)
         await self.invoke(ctx)